@@ -4,11 +4,16 @@ import logging
 import tempfile
 import shutil
 import sys
+import argparse
 from pathlib import Path
-from typing import List, Dict, Any, Optional
-from llama_api_client import LlamaAPIClient
-import requests
+from typing import Callable, List, Dict, Any, Optional, Union
 import glob
+from module_common import get_llama_client, get_http_session, get_ddgs_url, llama_client_scope
+from call_budget import get_budget, start_run, estimate_calls, is_near_duplicate, count_tokens
+from rate_limiter import limited_call
+from tracing import span, traced, current_span, set_trace_id
+from conversation import Conversation, ConversationView, dumps_document
+from singleflight import get_flight, request_key
 def atomic_write(file_path, data, mode='w', encoding='utf-8'):
     """Write data to a temp file and atomically move to destination."""
     dir_name = os.path.dirname(file_path)
@@ -29,14 +34,49 @@ from typing import Tuple
 
 
 # Helper to convert conversation history to the expected message format for LlamaAPIClient
-def to_message_params(history: List[Dict[str, str]]) -> list:
+def to_message_params(history: Union[Conversation, ConversationView, List[Dict[str, str]]]) -> list:
     # If the API expects a specific MessageParam type, adapt here. For now, assume dicts are fine.
     # If not, you may need to import MessageParam and construct objects.
+    if isinstance(history, (Conversation, ConversationView)):
+        # Reuses each message's cached dict instead of rebuilding it.
+        return history.to_message_params()
     return history
 
+# Calls the conversation loops leave unspent so the markdown summary can still be requested.
+MARKDOWN_CALL_RESERVE = 1
+
 # Move advanced_conversation_flow above main to ensure it's defined before use
-def advanced_conversation_flow(prompt: str, conversation_history: List[Dict[str, str]], max_turns: int = 5) -> List[Dict[str, str]]:
+@traced("conversation_flow")
+def advanced_conversation_flow(
+    prompt: str,
+    conversation_history: Union[Conversation, List[Dict[str, str]]],
+    max_turns: int = 5,
+    checkpoint_id: Optional[str] = None,
+    stage: str = "conversation",
+    start_turn: int = 0,
+    should_continue: Optional[Callable[[], bool]] = None,
+) -> Conversation:
+    """Run the multi-turn conversation loop and return the resulting Conversation.
+
+    A Conversation argument is extended in place and returned; any other history
+    (e.g. a list of dicts) is copied into a new Conversation and left unchanged,
+    so callers must use the return value.
+
+    When checkpoint_id is given, the turn index, pending prompt and history are
+    checkpointed before every turn so an interrupted run can continue from
+    start_turn with the same state (see --resume).
+
+    should_continue is checked before each turn; when it returns False the run
+    stops as interrupted without writing anything further (a queue worker that
+    lost its lease must leave the prompt's files to the new holder).
+
+    The loop stops early, without counting as interrupted, when the run's call
+    budget is spent (keeping MARKDOWN_CALL_RESERVE calls for the markdown
+    summary) or the conversation converges: a reply nearly repeats an
+    earlier assistant reply, or a suggested next prompt repeats an earlier one.
+    """
     output_dir = get_output_dir()
+    conversation_history = Conversation.coerce(conversation_history)
     # Allow user to set max_turns via env, min 5, max 10
     env_max_turns = os.environ.get("PONDER_LLAMA_MAX_TURNS")
     if env_max_turns:
@@ -53,95 +93,170 @@ def advanced_conversation_flow(prompt: str, conversation_history: List[Dict[str,
         prompt = conversation_history[-1]['content']
     if not prompt:
         prompt = ""
-    for turn in range(max_turns):
-        try:
-            response, updated_history = get_llama_response(prompt, conversation_history)
-            if not response:
-                logging.warning("No response from LLaMA API. Stopping conversation.")
-                break
-            model_reply = getattr(response.completion_message.content, 'text', None)
-            if not model_reply:
-                logging.warning("No text in model response. Stopping conversation.")
-                break
-            logging.info(f"Turn {turn+1} - Model: {model_reply}")
-            conversation_history.append({"role": "assistant", "content": model_reply})
-            save_conversation(conversation_history, output_dir=output_dir)
-            # Check for DDGS trigger
-            if "use_ddgs:" in model_reply:
-                query = model_reply.split("use_ddgs:", 1)[1].strip().split("\n")[0]
-                ddgs_results = ddgs_search(query)
-                user_msg = f"Here are the results of the DDGS search for '{query}': {json.dumps(ddgs_results, ensure_ascii=False)[:1000]}"
-                conversation_history.append({"role": "user", "content": user_msg})
-                prompt = user_msg
-                continue
-            # Optionally, ask the model for the next best question
-            if turn < max_turns - 1:
-                next_prompt = generate_next_prompt(conversation_history)
-                if next_prompt:
-                    logging.info(f"Next Prompt Suggestion: {next_prompt}")
-                    prompt = next_prompt
-                    conversation_history.append({"role": "user", "content": next_prompt})
-                else:
-                    logging.info("No next prompt generated. Ending conversation.")
-                    break
-        except Exception as e:
-            logging.error(f"Error in conversation flow at turn {turn+1}: {e}")
+    budget = get_budget()
+    interrupted = False
+    for turn in range(start_turn, max_turns):
+        if should_continue is not None and not should_continue():
+            logging.warning(f"Stopping {stage} at turn {turn+1}: this run may no longer continue.")
+            interrupted = True
             break
+        if checkpoint_id:
+            # Snapshot before the turn: a turn that was in flight when the run
+            # died is simply replayed from this state on resume.
+            save_checkpoint(checkpoint_id, stage, turn, prompt, conversation_history)
+        if not budget.allow(reserve=MARKDOWN_CALL_RESERVE):
+            budget.record_saved(estimate_calls(max_turns - turn), f"call budget exhausted at {stage} turn {turn+1}")
+            break
+        with span("conversation_turn", stage=stage, turn=turn+1):
+            try:
+                response, updated_history = get_llama_response(prompt, conversation_history)
+                if not response:
+                    logging.warning("No response from LLaMA API. Stopping conversation.")
+                    interrupted = True
+                    break
+                model_reply = getattr(response.completion_message.content, 'text', None)
+                if not model_reply:
+                    logging.warning("No text in model response. Stopping conversation.")
+                    interrupted = True
+                    break
+                logging.info(f"Turn {turn+1} - Model: {model_reply}")
+                previous_replies = conversation_history.contents("assistant")
+                conversation_history.append("assistant", model_reply)
+                if should_continue is not None and not should_continue():
+                    # Lost the right to write mid-turn; the new holder replays this turn.
+                    logging.warning(f"Discarding {stage} turn {turn+1}: this run may no longer continue.")
+                    interrupted = True
+                    break
+                # Per-prompt file so concurrent queue workers don't overwrite each other's progress.
+                history_file = f"conversation_history_{checkpoint_id}.json" if checkpoint_id else "conversation_history.json"
+                save_conversation(conversation_history, filename=history_file, output_dir=output_dir)
+                if is_near_duplicate(model_reply, previous_replies):
+                    budget.record_saved(estimate_calls(max_turns - turn - 1) + (1 if turn < max_turns - 1 else 0), f"{stage} converged at turn {turn+1}: reply repeats an earlier one")
+                    break
+                # Check for DDGS trigger
+                if "use_ddgs:" in model_reply:
+                    query = model_reply.split("use_ddgs:", 1)[1].strip().split("\n")[0]
+                    ddgs_results = ddgs_search(query)
+                    user_msg = f"Here are the results of the DDGS search for '{query}': {json.dumps(ddgs_results, ensure_ascii=False)[:1000]}"
+                    conversation_history.append("user", user_msg)
+                    prompt = user_msg
+                    continue
+                # Optionally, ask the model for the next best question
+                if turn < max_turns - 1:
+                    if not budget.allow(reserve=MARKDOWN_CALL_RESERVE):
+                        budget.record_saved(estimate_calls(max_turns - turn - 1), f"call budget exhausted before {stage} turn {turn+2}")
+                        break
+                    # Raises NextPromptError on API failure; handled below as an interrupted turn.
+                    next_prompt = generate_next_prompt(conversation_history)
+                    if next_prompt and is_near_duplicate(next_prompt, conversation_history.contents("user")):
+                        budget.record_saved(estimate_calls(max_turns - turn - 1), f"{stage} converged at turn {turn+1}: next prompt repeats an earlier one")
+                        break
+                    if next_prompt:
+                        logging.info(f"Next Prompt Suggestion: {next_prompt}")
+                        prompt = next_prompt
+                        conversation_history.append("user", next_prompt)
+                    else:
+                        logging.info("No next prompt generated. Ending conversation.")
+                        break
+            except Exception as e:
+                logging.error(f"Error in conversation flow at turn {turn+1}: {e}")
+                interrupted = True
+                break
+    if checkpoint_id and not interrupted and (should_continue is None or should_continue()):
+        save_checkpoint(checkpoint_id, stage, max_turns, prompt, conversation_history, complete=True)
+    current_span().set(stage=stage, messages=len(conversation_history), interrupted=interrupted)
     return conversation_history
 
+@traced("llama_chat")
 def get_llama_response(
     prompt: str,
-    conversation_history: List[Dict[str, str]],
+    conversation_history: Union[Conversation, ConversationView, List[Dict[str, str]]],
     model: str = "Llama-4-Maverick-17B-128E-Instruct-FP8"
 ) -> Tuple[Optional[Any], List[Dict[str, str]]]:
     """Send a prompt to the LLaMA API and return the response and updated conversation history."""
+    budget = get_budget()
+    if not budget.allow():
+        logging.warning("Call budget exhausted. Skipping LLaMA request.")
+        return None, conversation_history
     try:
-        client = LlamaAPIClient(
-            api_key=os.environ.get("LLAMA_API_KEY"),
-            base_url="https://api.llama.com/v1/",
-        )
-        messages = to_message_params(conversation_history + [{"role": "user", "content": prompt}])
-        response = client.chat.completions.create(
+        client = get_llama_client()
+        if isinstance(conversation_history, (Conversation, ConversationView)):
+            # Shared view of the history plus the prompt: no copy of the history itself.
+            messages = to_message_params(conversation_history.with_pending("user", prompt))
+        else:
+            messages = to_message_params(conversation_history + [{"role": "user", "content": prompt}])
+        # Identical requests already in flight on another thread share that call.
+        response, shared = get_flight("llama").do(
+            # Clients with different keys or endpoints never share a response.
+            request_key(llama_client_scope(client), model, messages),
+            limited_call,
+            f"llama_{model}",
+            client.chat.completions.create,
             model=model,
             messages=messages,
         )
+        tokens = count_tokens(response, prompt)
+        if not shared:
+            budget.charge(tokens)
+        sp = current_span()
+        if sp:
+            sp.set(model=model, messages=len(messages), tokens=tokens, payload_bytes=sum(len(m["content"]) for m in messages))
         return response, messages
     except Exception as e:
         logging.error(f"Error getting LLaMA response: {e}")
+        current_span().set(failed=True)
         return None, conversation_history
 
+@traced("ddgs_search")
 def ddgs_search(query: str) -> Dict:
     """Perform a DuckDuckGo search and return the results as a dict."""
-    url = "https://api.duckduckgo.com/"
+    url = get_ddgs_url()
     params = {"q": query, "format": "json"}
-    try:
-        response = requests.get(url, params=params, timeout=10)
+    def _get():
+        response = get_http_session().get(url, params=params, timeout=10)
         response.raise_for_status()
+        return response
+    try:
+        response, _ = get_flight("ddgs").do(request_key(url, query), limited_call, "ddgs", _get)
+        current_span().set(response_bytes=len(response.content))
         return response.json()
     except Exception as e:
         logging.error(f"DDGS search failed: {e}")
+        current_span().set(failed=True)
         return {"error": str(e)}
 
-def generate_next_prompt(conversation_history: List[Dict[str, str]]) -> Optional[str]:
-    """Ask the model to suggest a good next question based on the conversation so far."""
+class NextPromptError(RuntimeError):
+    """The next-prompt request failed, as opposed to returning no suggestion."""
+
+def generate_next_prompt(conversation_history: Union[Conversation, List[Dict[str, str]]]) -> Optional[str]:
+    """Ask the model to suggest a good next question based on the conversation so far.
+
+    Returns None if the model made no suggestion; raises NextPromptError if the
+    request itself failed, so the caller can treat the turn as interrupted.
+    """
     prompt = "Based on our conversation so far, what would be a good next question to ask?"
     response, _ = get_llama_response(prompt, conversation_history)
-    if response:
-        return getattr(response.completion_message.content, 'text', None)
-    return None
+    if not response:
+        raise NextPromptError("No response from LLaMA API for the next-prompt request")
+    return getattr(response.completion_message.content, 'text', None)
 
-def save_conversation(conversation_history: List[Dict[str, str]], filename: str = "conversation_history.json", output_dir: str = "output"):
+@traced("save_conversation")
+def save_conversation(conversation_history: Union[Conversation, List[Dict[str, str]]], filename: str = "conversation_history.json", output_dir: str = "output"):
     try:
         output_dir = get_output_dir()
         Path(output_dir).mkdir(parents=True, exist_ok=True)
         file_path = os.path.join(output_dir, filename)
-        data = json.dumps(conversation_history, indent=4, ensure_ascii=False)
+        if isinstance(conversation_history, Conversation):
+            data = conversation_history.to_json()
+        else:
+            data = json.dumps(conversation_history, indent=4, ensure_ascii=False)
         atomic_write(file_path, data)
+        current_span().set(messages=len(conversation_history), payload_bytes=len(data))
         logging.info(f"Conversation history saved to {file_path}")
     except Exception as e:
         logging.error(f"Failed to save conversation history: {e}")
 
-def save_summary(conversation_history: List[Dict[str, str]], filename: str = "output.json"):
+def save_summary(conversation_history: Union[Conversation, List[Dict[str, str]]], filename: str = "output.json"):
     output_dir = get_output_dir()
     try:
         Path(output_dir).mkdir(parents=True, exist_ok=True)
@@ -151,15 +266,60 @@ def save_summary(conversation_history: List[Dict[str, str]], filename: str = "ou
             "summary": summary
         }
         file_path = os.path.join(output_dir, filename)
-        data = json.dumps(output, indent=4, ensure_ascii=False)
+        data = dumps_document(output)
         atomic_write(file_path, data)
         logging.info(f"Summary saved to {file_path}")
     except Exception as e:
         logging.error(f"Failed to save summary: {e}")
 
-def generate_markdown_summary(conversation_history: List[Dict[str, str]], output_json_path: str = "output.json", output_md_path: str = "output.md"):
-    """Call LLaMA API to process the output.json and conversation, and write a narrative markdown file."""
+def get_checkpoint_path(prompt_id: str) -> str:
+    return os.path.join(get_output_dir(), f"checkpoint_{prompt_id}.json")
+
+def save_checkpoint(prompt_id: str, stage: str, turn: int, pending_prompt: str, conversation_history: Union[Conversation, List[Dict[str, str]]], complete: bool = False):
+    """Atomically record where a run is, so --resume can continue from there."""
+    checkpoint = {
+        "prompt_id": prompt_id,
+        "stage": stage,
+        "turn": turn,
+        "complete": complete,
+        "pending_prompt": pending_prompt,
+        "conversation_history": conversation_history,
+    }
+    try:
+        atomic_write(get_checkpoint_path(prompt_id), dumps_document(checkpoint))
+    except Exception as e:
+        logging.error(f"Failed to save checkpoint: {e}")
+
+def load_checkpoint(prompt_id: str) -> Optional[Dict[str, Any]]:
+    file_path = get_checkpoint_path(prompt_id)
+    if not os.path.exists(file_path):
+        return None
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        logging.error(f"Failed to load checkpoint {file_path}: {e}")
+        return None
+
+def clear_checkpoint(prompt_id: str):
+    try:
+        os.remove(get_checkpoint_path(prompt_id))
+    except FileNotFoundError:
+        pass
+
+def _stage_interrupted(prompt_id: str, stage: str) -> bool:
+    checkpoint = load_checkpoint(prompt_id)
+    return bool(checkpoint and checkpoint["stage"] == stage and not checkpoint["complete"])
+
+def generate_markdown_summary(conversation_history: Union[Conversation, List[Dict[str, str]]], output_json_path: str = "output.json", output_md_path: str = "output.md", checkpoint_id: Optional[str] = None, resume_state: Optional[Dict[str, Any]] = None, should_continue: Optional[Callable[[], bool]] = None) -> bool:
+    """Call LLaMA API to process the output.json and conversation, and write a narrative markdown file.
+
+    Returns False if no markdown was written; the markdown stage is then left
+    checkpointed as interrupted so a resume retries the call. The follow-up
+    conversation extends conversation_history if it is a Conversation.
+    """
     output_dir = get_output_dir()
+    conversation_history = Conversation.coerce(conversation_history)
     max_turns = 5  # Default value
     env_max_turns = os.environ.get("PONDER_LLAMA_MAX_TURNS")
     if env_max_turns:
@@ -171,11 +331,18 @@ def generate_markdown_summary(conversation_history: List[Dict[str, str]], output
                 max_turns = 10
         except Exception:
             max_turns = 5
+    if resume_state and os.path.exists(os.path.join(output_dir, output_md_path)):
+        # The markdown call already succeeded before this stage was checkpointed.
+        advanced_conversation_flow(resume_state["pending_prompt"], conversation_history, max_turns=max_turns, checkpoint_id=checkpoint_id, stage="markdown", start_turn=resume_state["turn"], should_continue=should_continue)
+        return True
+    written = False
     try:
         Path(output_dir).mkdir(parents=True, exist_ok=True)
         output_json_full = os.path.join(output_dir, output_json_path)
         with open(output_json_full, "r", encoding="utf-8") as f:
             output_data = json.load(f)
+        # Same history that was just saved to output_json_path; reuse its cached encoding.
+        history_json = conversation_history.to_json(indent=2)
         prompt = (
             "Given the following conversation history and summary, generate a markdown file that narrates the conversation "
             "in a clear, engaging, and common-sense way, suitable for a project report or documentation. "
@@ -185,7 +352,7 @@ def generate_markdown_summary(conversation_history: List[Dict[str, str]], output
             "The script should be more than just a print statement or placeholder. "
             "For example, if the conversation is about a calculator, output a script that implements a Calculator class and a main function that demonstrates its use. "
             "Wrap the code in a Python code block.\n\n"
-            f"Conversation History (JSON):\n{json.dumps(output_data['conversation_history'], ensure_ascii=False, indent=2)}\n\n"
+            f"Conversation History (JSON):\n{history_json}\n\n"
             f"Summary: {output_data.get('summary', '')}\n\n"
             "---\n\nMarkdown Output:"
         )
@@ -193,7 +360,12 @@ def generate_markdown_summary(conversation_history: List[Dict[str, str]], output
         response, _ = get_llama_response(prompt, context_history)
         if response:
             markdown = getattr(response.completion_message.content, 'text', None)
+            if should_continue is not None and not should_continue():
+                logging.warning("Discarding markdown summary: this run may no longer continue.")
+                return False
             if markdown and markdown.strip():
+                atomic_write(os.path.join(output_dir, output_md_path), markdown)
+                written = True
                 logging.info("Markdown summary generated. Results will be analyzed for code quality, dependencies, and feedback in the Action Plan.")
             else:
                 logging.warning("No markdown text returned from LLaMA API or markdown is empty.")
@@ -201,73 +373,108 @@ def generate_markdown_summary(conversation_history: List[Dict[str, str]], output
             logging.warning("No response from LLaMA API for markdown summary.")
     except Exception as e:
         logging.error(f"Failed to generate markdown summary: {e}")
-    # Ensure prompt is always defined
-    prompt = conversation_history[-1]['content'] if conversation_history else ""
-    for turn in range(max_turns):
-        try:
-            response, updated_history = get_llama_response(prompt, conversation_history)
-            if not response:
-                logging.warning("No response from LLaMA API. Stopping conversation.")
-                break
-            model_reply = getattr(response.completion_message.content, 'text', None)
-            if not model_reply:
-                logging.warning("No text in model response. Stopping conversation.")
-                break
-            logging.info(f"Turn {turn+1} - Model: {model_reply}")
-            conversation_history.append({"role": "assistant", "content": model_reply})
-            save_conversation(conversation_history, output_dir=output_dir)
-            # Check for DDGS trigger
-            if "use_ddgs:" in model_reply:
-                query = model_reply.split("use_ddgs:", 1)[1].strip().split("\n")[0]
-                ddgs_results = ddgs_search(query)
-                user_msg = f"Here are the results of the DDGS search for '{query}': {json.dumps(ddgs_results, ensure_ascii=False)[:1000]}"
-                conversation_history.append({"role": "user", "content": user_msg})
-                prompt = user_msg
-                continue
-            # Optionally, ask the model for the next best question
-            if turn < max_turns - 1:
-                next_prompt = generate_next_prompt(conversation_history)
-                if next_prompt:
-                    logging.info(f"Next Prompt Suggestion: {next_prompt}")
-                    prompt = next_prompt
-                    conversation_history.append({"role": "user", "content": next_prompt})
-                else:
-                    logging.info("No next prompt generated. Ending conversation.")
-                    break
-        except Exception as e:
-            logging.error(f"Error in conversation flow at turn {turn+1}: {e}")
-            break
-    return conversation_history
+    if not written:
+        if checkpoint_id:
+            save_checkpoint(checkpoint_id, "markdown", 0, "", conversation_history)
+        return False
+    advanced_conversation_flow("", conversation_history, max_turns=max_turns, checkpoint_id=checkpoint_id, stage="markdown", should_continue=should_continue)
+    return True
 
-def main():
-    logging.info("Starting LLaMA prompt processor...")
-    prompts_dir = "prompts"
+def process_prompt_file(prompt_file: str, resume: bool = False, should_continue: Optional[Callable[[], bool]] = None) -> bool:
+    """Run the conversation and markdown stages for one prompt file.
+
+    Returns True once the prompt is fully processed, False if it was skipped or
+    interrupted (in which case its checkpoint is kept for a later resume).
+    should_continue is checked at every turn and before outputs are written.
+    """
     output_dir = get_output_dir()
     Path(output_dir).mkdir(parents=True, exist_ok=True)
-    Path(prompts_dir).mkdir(parents=True, exist_ok=True)
-    prompt_files = sorted(glob.glob(os.path.join(prompts_dir, "prompt_*.json")), key=os.path.getmtime, reverse=True)
-    if not prompt_files:
-        print("No prompt files found in 'prompts' directory. Please run 4.py to create a prompt.")
-        return
-    # Only process the most recent prompt file
-    prompt_file = prompt_files[0]
     with open(prompt_file, "r", encoding="utf-8") as f:
         prompt_data = json.load(f)
     prompt_id = prompt_data.get("id")
     prompt = prompt_data.get("prompt")
     if not prompt_id or not prompt:
         logging.warning(f"Skipping {prompt_file}: missing id or prompt.")
-        return
-    conversation_history = []
-    conversation_history.append({"role": "user", "content": prompt})
-    # You can adjust max_turns or other params here if needed
-    conversation_history = advanced_conversation_flow(prompt, conversation_history, max_turns=1)
+        return False
+    set_trace_id(prompt_id)
+    checkpoint = load_checkpoint(prompt_id) if resume else None
+    budget = start_run(prompt_id, fresh=not checkpoint, guard=should_continue)
+    if resume and not checkpoint:
+        logging.warning(f"No checkpoint found for prompt {prompt_id}. Starting from the first turn.")
+    markdown_state = None
+    if checkpoint and checkpoint["stage"] == "markdown":
+        conversation_history = Conversation(checkpoint["conversation_history"])
+        if checkpoint["complete"]:
+            clear_checkpoint(prompt_id)
+            print(f"\nPrompt {prompt_id} was already fully processed. Output files are in: {os.path.abspath(output_dir)}")
+            return True
+        markdown_state = checkpoint
+        logging.info(f"Resuming prompt {prompt_id} at markdown turn {checkpoint['turn']+1}.")
+    elif checkpoint and checkpoint["complete"]:
+        conversation_history = Conversation(checkpoint["conversation_history"])
+        logging.info(f"Resuming prompt {prompt_id} after the completed conversation.")
+    else:
+        if checkpoint:
+            conversation_history = Conversation(checkpoint["conversation_history"])
+            start_turn = checkpoint["turn"]
+            prompt = checkpoint["pending_prompt"]
+            logging.info(f"Resuming prompt {prompt_id} at conversation turn {start_turn+1}.")
+        else:
+            conversation_history = Conversation()
+            conversation_history.append("user", prompt)
+            start_turn = 0
+        # You can adjust max_turns or other params here if needed
+        conversation_history = advanced_conversation_flow(prompt, conversation_history, max_turns=1, checkpoint_id=prompt_id, start_turn=start_turn, should_continue=should_continue)
+        if should_continue is not None and not should_continue():
+            return False
+        if _stage_interrupted(prompt_id, "conversation"):
+            print(f"\nConversation for prompt {prompt_id} was interrupted. Rerun with: python 3.py --resume {prompt_id}")
+            return False
     # Save outputs with prompt_id in filenames
     save_conversation(conversation_history, filename=f"conversation_history_{prompt_id}.json")
     save_summary(conversation_history, filename=f"output_{prompt_id}.json")
-    generate_markdown_summary(conversation_history, output_json_path=f"output_{prompt_id}.json", output_md_path=f"output_{prompt_id}.md")
+    if should_continue is not None and not should_continue():
+        return False
+    if not os.path.exists(os.path.join(output_dir, f"output_{prompt_id}.md")) and not budget.allow():
+        # Only possible with a budget too small for even the reserved call: a final stop, not resumable.
+        budget.record_saved(1, "call budget exhausted before the markdown summary")
+        clear_checkpoint(prompt_id)
+        print(f"\nCall budget exhausted before the markdown summary for prompt {prompt_id}; no markdown written. Raise PONDER_LLAMA_MAX_CALLS or PONDER_LLAMA_MAX_TOKENS and run it again.")
+        print(budget.summary_line())
+        return False
+    written = generate_markdown_summary(conversation_history, output_json_path=f"output_{prompt_id}.json", output_md_path=f"output_{prompt_id}.md", checkpoint_id=prompt_id, resume_state=markdown_state, should_continue=should_continue)
+    if should_continue is not None and not should_continue():
+        return False
+    if not written or _stage_interrupted(prompt_id, "markdown"):
+        print(f"\nMarkdown stage for prompt {prompt_id} was interrupted. Rerun with: python 3.py --resume {prompt_id}")
+        return False
+    clear_checkpoint(prompt_id)
     print(f"\nProcessed prompt {prompt_id}. Output files saved to: {os.path.abspath(output_dir)}")
+    print(budget.summary_line())
     logging.info(f"Processed prompt {prompt_id} and saved outputs.")
+    return True
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Process the newest prompt (or --resume one). Returns the exit status: 0 on success."""
+    parser = argparse.ArgumentParser(description="StepForge Step 3: LLaMA prompt processor")
+    parser.add_argument("--resume", metavar="PROMPT_ID", help="continue an interrupted run from its last checkpoint")
+    args = parser.parse_args(argv)
+    logging.info("Starting LLaMA prompt processor...")
+    prompts_dir = "prompts"
+    Path(prompts_dir).mkdir(parents=True, exist_ok=True)
+    if args.resume:
+        prompt_file = os.path.join(prompts_dir, f"prompt_{args.resume}.json")
+        if not os.path.exists(prompt_file):
+            print(f"Prompt file {prompt_file} not found. Cannot resume.")
+            return 1
+    else:
+        prompt_files = sorted(glob.glob(os.path.join(prompts_dir, "prompt_*.json")), key=os.path.getmtime, reverse=True)
+        if not prompt_files:
+            print("No prompt files found in 'prompts' directory. Please run 4.py to create a prompt.")
+            return 1
+        # Only process the most recent prompt file
+        prompt_file = prompt_files[0]
+    return 0 if process_prompt_file(prompt_file, resume=bool(args.resume)) else 1
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,182 @@
+"""
+mock_server.py (Local stand-in for the LLaMA and DuckDuckGo APIs)
+
+Serves POST /v1/chat/completions in the LLaMA API response format and GET /
+in the DuckDuckGo instant-answer format, with configurable latency, error rate
+and response sizes. Point the pipeline at it with:
+
+    python benchmarks/mock_server.py --port 8766 --latency 0.2
+    set LLAMA_API_BASE_URL=http://127.0.0.1:8766/v1/
+    set PONDER_LLAMA_DDGS_URL=http://127.0.0.1:8766/
+    set LLAMA_API_KEY=mock
+"""
+
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+
+WORDS = (
+    "qubit superposition entanglement calculator matrix vector gradient cache "
+    "latency pipeline module function class test deploy refactor benchmark"
+).split()
+
+@dataclass
+class MockConfig:
+    latency: float = 0.05          # seconds added to every response
+    jitter: float = 0.0            # +/- uniform jitter on latency
+    error_rate: float = 0.0        # share of chat requests answered with an error
+    error_status: int = 429        # status used for injected errors
+    reply_chars: int = 800         # approximate size of each chat reply
+    ddgs_rate: float = 0.0         # share of chat replies that request a search
+    ddgs_chars: int = 2000         # approximate size of each search response
+    seed: Optional[int] = None
+
+class MockState:
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.lock = threading.Lock()
+        self.chat_requests = 0
+        self.ddgs_requests = 0
+        self.errors = 0
+
+    def text(self, chars: int) -> str:
+        with self.lock:
+            words = []
+            size = 0
+            while size < chars:
+                word = self.random.choice(WORDS)
+                words.append(word)
+                size += len(word) + 1
+        return " ".join(words)
+
+    def delay(self):
+        jitter = self.config.jitter
+        with self.lock:
+            offset = self.random.uniform(-jitter, jitter) if jitter else 0.0
+        time.sleep(max(0.0, self.config.latency + offset))
+
+    def roll(self, rate: float) -> bool:
+        with self.lock:
+            return self.random.random() < rate
+
+class MockHandler(BaseHTTPRequestHandler):
+    state: MockState = None  # set by start_mock_server()
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, code: int, payload: dict, headers: Optional[dict] = None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        state = self.state
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length)
+        if not urlparse(self.path).path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"detail": f"Unknown path {self.path}"})
+            return
+        try:
+            request = json.loads(raw or b"{}")
+        except ValueError:
+            self._send_json(400, {"detail": "Invalid JSON"})
+            return
+        with state.lock:
+            state.chat_requests += 1
+            request_number = state.chat_requests
+        state.delay()
+        if state.roll(state.config.error_rate):
+            with state.lock:
+                state.errors += 1
+            self._send_json(state.config.error_status, {"detail": "Injected mock error"}, {"Retry-After": "0"})
+            return
+        reply = f"Mock reply {request_number}: " + state.text(state.config.reply_chars)
+        if state.roll(state.config.ddgs_rate):
+            reply += f"\nuse_ddgs: {state.text(24)}"
+        prompt_chars = sum(len(str(m.get("content", ""))) for m in request.get("messages", []))
+        prompt_tokens, completion_tokens = prompt_chars // 4, len(reply) // 4
+        self._send_json(200, {
+            "id": f"mock-{uuid.uuid4().hex}",
+            "completion_message": {
+                "role": "assistant",
+                "content": {"type": "text", "text": reply},
+                "stop_reason": "stop",
+            },
+            "metrics": [
+                {"metric": "num_prompt_tokens", "value": prompt_tokens, "unit": "tokens"},
+                {"metric": "num_completion_tokens", "value": completion_tokens, "unit": "tokens"},
+                {"metric": "num_total_tokens", "value": prompt_tokens + completion_tokens, "unit": "tokens"},
+            ],
+        })
+
+    def do_GET(self):
+        state = self.state
+        url = urlparse(self.path)
+        if url.path != "/":
+            self._send_json(404, {"detail": f"Unknown path {self.path}"})
+            return
+        query = parse_qs(url.query).get("q", [""])[0]
+        with state.lock:
+            state.ddgs_requests += 1
+        state.delay()
+        topics = []
+        size = 0
+        while size < state.config.ddgs_chars:
+            text = state.text(120)
+            topics.append({"Text": text, "FirstURL": f"https://duckduckgo.com/{text.split()[0]}"})
+            size += len(text) + 40
+        self._send_json(200, {"Heading": query, "Abstract": state.text(200), "RelatedTopics": topics})
+
+def start_mock_server(config: MockConfig, host: str = "127.0.0.1", port: int = 0) -> Tuple[ThreadingHTTPServer, MockState]:
+    """Start the mock server on a background thread. port=0 picks a free port."""
+    state = MockState(config)
+    handler = type("BoundMockHandler", (MockHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock LLaMA/DuckDuckGo server for local benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency", type=float, default=MockConfig.latency)
+    parser.add_argument("--jitter", type=float, default=MockConfig.jitter)
+    parser.add_argument("--error-rate", type=float, default=MockConfig.error_rate)
+    parser.add_argument("--error-status", type=int, default=MockConfig.error_status)
+    parser.add_argument("--reply-chars", type=int, default=MockConfig.reply_chars)
+    parser.add_argument("--ddgs-rate", type=float, default=MockConfig.ddgs_rate)
+    parser.add_argument("--ddgs-chars", type=int, default=MockConfig.ddgs_chars)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    config = MockConfig(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, error_status=args.error_status,
+        reply_chars=args.reply_chars, ddgs_rate=args.ddgs_rate, ddgs_chars=args.ddgs_chars, seed=args.seed,
+    )
+    server, state = start_mock_server(config, args.host, args.port)
+    host, port = server.server_address[:2]
+    print(f"Mock LLaMA/DDGS server on http://{host}:{port} (LLAMA_API_BASE_URL=http://{host}:{port}/v1/)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print(f"\nServed {state.chat_requests} chat and {state.ddgs_requests} search requests ({state.errors} injected errors).")
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
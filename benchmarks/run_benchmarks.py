@@ -0,0 +1,219 @@
+"""
+run_benchmarks.py (StepForge benchmark suite)
+
+Runs the pipeline against the local mock server (benchmarks/mock_server.py), so no
+API key or network access is needed, and reports:
+
+- conversation turns/sec and per-turn latency percentiles (3.py)
+- save_conversation serialization cost for growing histories (3.py)
+- five_action.py end-to-end time
+
+Results go to benchmarks/results/latest.json and are compared against
+benchmarks/baseline.json; a metric that is worse than baseline by more than
+--tolerance is flagged and makes the run exit with status 1.
+
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --update-baseline
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import logging
+import argparse
+import tempfile
+import importlib
+import importlib.util
+import contextlib
+from datetime import datetime
+from typing import Dict, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, BENCH_DIR)
+from mock_server import MockConfig, start_mock_server  # noqa: E402
+from conversation import Conversation  # noqa: E402
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+def metric(value: float, unit: str, better: str = "lower") -> Dict:
+    return {"value": round(value, 6), "unit": unit, "better": better}
+
+def spans_for(tracing, trace_id: str, name: str) -> List[Dict]:
+    return [s for s in tracing.read_spans() if s.get("trace_id") == trace_id and s["name"] == name]
+
+def bench_conversation(step3, tracing, runs: int, max_turns: int) -> Dict[str, Dict]:
+    turns = 0
+    wall = 0.0
+    for run in range(runs + 1):
+        trace_id = f"bench-conversation-{run}"
+        tracing.set_trace_id(trace_id)
+        history = Conversation([{"role": "user", "content": "Build a calculator that adds and multiplies numbers."}])
+        started = time.perf_counter()
+        step3.advanced_conversation_flow(history[0]["content"], history, max_turns=max_turns)
+        elapsed = time.perf_counter() - started
+        if run == 0:
+            continue  # warm-up: imports, client construction, connection setup
+        wall += elapsed
+        turns += len(spans_for(tracing, trace_id, "conversation_turn"))
+    turn_ms = [s["duration"] * 1000 for run in range(1, runs + 1) for s in spans_for(tracing, f"bench-conversation-{run}", "conversation_turn")]
+    chat_ms = [s["duration"] * 1000 for run in range(1, runs + 1) for s in spans_for(tracing, f"bench-conversation-{run}", "llama_chat")]
+    return {
+        "conversation.turns_per_sec": metric(turns / wall if wall else 0.0, "turns/s", "higher"),
+        "conversation.turn_p50_ms": metric(percentile(turn_ms, 50), "ms"),
+        "conversation.turn_p90_ms": metric(percentile(turn_ms, 90), "ms"),
+        "conversation.turn_p99_ms": metric(percentile(turn_ms, 99), "ms"),
+        "conversation.llama_chat_p50_ms": metric(percentile(chat_ms, 50), "ms"),
+    }
+
+def bench_save_conversation(step3, tracing, sizes: List[int], repeat: int, message_chars: int = 500) -> Dict[str, Dict]:
+    results = {}
+    for size in sizes:
+        history = Conversation(
+            {"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i} " + "x" * message_chars}
+            for i in range(size)
+        )
+        trace_id = f"bench-save-{size}"
+        tracing.set_trace_id(trace_id)
+        for _ in range(repeat):
+            step3.save_conversation(history, filename="bench_history.json")
+        durations = [s["duration"] * 1000 for s in spans_for(tracing, trace_id, "save_conversation")]
+        results[f"save_conversation.{size}_messages_ms"] = metric(percentile(durations, 50), "ms")
+    return results
+
+def bench_five_action(five_action, runs: int) -> Dict[str, Dict]:
+    prompt_id = "bench"
+    os.makedirs("prompts", exist_ok=True)
+    os.makedirs("output", exist_ok=True)
+    with open(os.path.join("prompts", f"prompt_{prompt_id}.json"), "w", encoding="utf-8") as f:
+        json.dump({"id": prompt_id, "goal": "Build a calculator", "prompt": "Build a calculator"}, f)
+    with open(os.path.join("output", f"output_{prompt_id}.md"), "w", encoding="utf-8") as f:
+        f.write(
+            "## Overview\nA small calculator.\n\n## Summary\nAdds and multiplies.\n\n"
+            "```python\nclass Calculator:\n    def add(self, a, b):\n        return a + b\n\n"
+            "    def multiply(self, a, b):\n        return a * b\n\n\nprint(Calculator().add(2, 3))\n```\n"
+        )
+    timings = []
+    for run in range(runs + 1):
+        started = time.perf_counter()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            five_action.main()
+        if run:
+            timings.append((time.perf_counter() - started) * 1000)
+    return {
+        "five_action.end_to_end_p50_ms": metric(percentile(timings, 50), "ms"),
+        "five_action.end_to_end_max_ms": metric(max(timings) if timings else 0.0, "ms"),
+    }
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float) -> List[str]:
+    """Print a comparison table and return the names of regressed metrics."""
+    regressions = []
+    print(f"\n{'metric':<40}{'value':>12}{'baseline':>12}{'change':>10}  unit")
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        line = f"{name:<40}{result['value']:>12.3f}"
+        if base and base["value"]:
+            change = (result["value"] - base["value"]) / base["value"]
+            line += f"{base['value']:>12.3f}{change:>+10.1%}  {result['unit']}"
+            worse = change > tolerance if result["better"] == "lower" else change < -tolerance
+            if worse:
+                line += "  REGRESSION"
+                regressions.append(name)
+        else:
+            line += f"{'-':>12}{'-':>10}  {result['unit']}"
+        print(line)
+    return regressions
+
+def configure_environment(workdir: str, base: str, max_turns: int):
+    os.environ.update({
+        "LLAMA_API_KEY": "mock",
+        "LLAMA_API_BASE_URL": f"{base}/v1/",
+        "PONDER_LLAMA_DDGS_URL": f"{base}/",
+        "PONDER_LLAMA_OUTPUT_DIR": os.path.join(workdir, "output"),
+        "PONDER_LLAMA_RATE_DIR": os.path.join(workdir, "ratelimit"),
+        "PONDER_LLAMA_RATE_LIMIT": "0",
+        "PONDER_LLAMA_CONVERGENCE_THRESHOLD": "0",
+        "PONDER_LLAMA_MAX_TURNS": str(max_turns),
+        "PONDER_LLAMA_TRACE": "1",
+    })
+    for name in ("PONDER_LLAMA_MAX_CALLS", "PONDER_LLAMA_MAX_TOKENS"):
+        os.environ.pop(name, None)
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="StepForge benchmark suite (uses a local mock server)")
+    parser.add_argument("--runs", type=int, default=3, help="measured runs per benchmark (after one warm-up)")
+    parser.add_argument("--turns", type=int, default=5, help="conversation turns per run (5-10)")
+    parser.add_argument("--latency", type=float, default=0.02, help="mock server latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--reply-chars", type=int, default=800)
+    parser.add_argument("--ddgs-rate", type=float, default=0.2)
+    parser.add_argument("--sizes", default="10,100,1000", help="history sizes for save_conversation")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown vs baseline")
+    parser.add_argument("--update-baseline", action="store_true", help="store these results as the new baseline")
+    args = parser.parse_args(argv)
+
+    config = MockConfig(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                        reply_chars=args.reply_chars, ddgs_rate=args.ddgs_rate, seed=1234)
+    server, state = start_mock_server(config)
+    host, port = server.server_address[:2]
+    workdir = tempfile.mkdtemp(prefix="ponder_llama_bench_")
+    configure_environment(workdir, f"http://{host}:{port}", args.turns)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        step3 = importlib.import_module("3")
+        five_action = importlib.import_module("five_action")
+        tracing = importlib.import_module("tracing")
+        logging.getLogger().setLevel(logging.WARNING)
+
+        results: Dict[str, Dict] = {}
+        if importlib.util.find_spec("llama_api_client") is None:
+            print("llama_api_client is not installed; skipping conversation benchmarks.")
+        else:
+            results.update(bench_conversation(step3, tracing, args.runs, args.turns))
+        sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+        results.update(bench_save_conversation(step3, tracing, sizes, repeat=max(5, args.runs)))
+        results.update(bench_five_action(five_action, args.runs))
+    finally:
+        os.chdir(cwd)
+        server.shutdown()
+
+    print(f"Mock server: {state.chat_requests} chat, {state.ddgs_requests} search requests, {state.errors} injected errors.")
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, "r", encoding="utf-8") as f:
+            baseline = json.load(f).get("metrics", {})
+    regressions = compare(results, baseline, args.tolerance)
+
+    report = {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "settings": vars(args),
+        "metrics": results,
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(os.path.join(RESULTS_DIR, "latest.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    if args.update_baseline:
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+        print(f"\nBaseline updated: {BASELINE_PATH}")
+    elif regressions:
+        print(f"\n{len(regressions)} metric(s) regressed by more than {args.tolerance:.0%}.")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
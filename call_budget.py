@@ -0,0 +1,198 @@
+import os
+import json
+import logging
+import threading
+import contextvars
+from difflib import SequenceMatcher
+from typing import Callable, List, Dict, Any, Optional
+from module_common import atomic_write, get_output_dir
+
+# Per-run API call/token budget shared by 3.py and five_action.py. The ledger is
+# persisted as output/budget_<prompt_id>.json so the action-plan step keeps
+# spending from the same budget as the conversation step of that run.
+
+_current_budget: contextvars.ContextVar = contextvars.ContextVar("ponder_llama_budget", default=None)
+_default_budget = None
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.environ.get(name)
+    if not value:
+        return None
+    try:
+        return max(0, int(value))
+    except ValueError:
+        logging.warning(f"Ignoring invalid {name}={value!r}")
+        return None
+
+def get_convergence_threshold() -> float:
+    """Similarity (0-1) above which two replies count as converged. 0 disables detection."""
+    try:
+        return float(os.environ.get("PONDER_LLAMA_CONVERGENCE_THRESHOLD", "0.9"))
+    except ValueError:
+        return 0.9
+
+def estimate_calls(turns_left: int) -> int:
+    """Calls a conversation loop makes for the given number of remaining turns.
+
+    Every turn costs one completion plus one next-prompt suggestion, except the
+    last turn, which does not ask for a next prompt.
+    """
+    return max(0, 2 * turns_left - 1)
+
+# Above this length SequenceMatcher.ratio() (quadratic in pure Python) is replaced
+# by Jaccard similarity of word shingles, which is linear in the text length.
+SHORT_TEXT_CHARS = 400
+SHINGLE_WORDS = 3
+
+def _shingles(words: List[str]) -> set:
+    if len(words) < SHINGLE_WORDS:
+        return {tuple(words)}
+    return {tuple(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+def similarity(a: str, b: str) -> float:
+    """Similarity (0-1) of two whitespace-normalized, lowercased texts."""
+    if a == b:
+        return 1.0
+    if len(a) <= SHORT_TEXT_CHARS and len(b) <= SHORT_TEXT_CHARS:
+        return SequenceMatcher(None, a, b, autojunk=False).ratio()
+    left, right = _shingles(a.split()), _shingles(b.split())
+    if not left or not right:
+        return 0.0
+    return len(left & right) / len(left | right)
+
+def is_near_duplicate(text: str, previous: List[str], threshold: Optional[float] = None, window: int = 3) -> bool:
+    """Return True if text is nearly identical to one of the last few previous texts."""
+    if threshold is None:
+        threshold = get_convergence_threshold()
+    if not text or threshold <= 0:
+        return False
+    normalized = " ".join(text.lower().split())
+    for other in previous[-window:]:
+        other = " ".join((other or "").lower().split())
+        if not other:
+            continue
+        if similarity(normalized, other) >= threshold:
+            return True
+    return False
+
+def count_tokens(response: Any, fallback_text: str = "") -> int:
+    """Read the total token count from a LLaMA API response, or estimate it from text."""
+    for metric in getattr(response, "metrics", None) or []:
+        if getattr(metric, "metric", None) == "num_total_tokens":
+            try:
+                return int(metric.value)
+            except (TypeError, ValueError):
+                break
+    reply = getattr(getattr(getattr(response, "completion_message", None), "content", None), "text", None) or ""
+    return (len(fallback_text) + len(reply)) // 4
+
+class CallBudget:
+    """Counts API calls and tokens for one run and enforces optional limits."""
+
+    def __init__(self, run_id: Optional[str] = None, max_calls: Optional[int] = None, max_tokens: Optional[int] = None):
+        self.run_id = run_id
+        self.max_calls = max_calls
+        self.max_tokens = max_tokens
+        self.calls = 0
+        self.tokens = 0
+        self.saved = 0
+        self.stops: List[Dict[str, Any]] = []
+        # When set and returning False, the ledger is no longer written (e.g. a queue worker lost its lease).
+        self.guard: Optional[Callable[[], bool]] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, run_id: Optional[str] = None) -> "CallBudget":
+        return cls(run_id, _env_int("PONDER_LLAMA_MAX_CALLS"), _env_int("PONDER_LLAMA_MAX_TOKENS"))
+
+    def path(self) -> Optional[str]:
+        return os.path.join(get_output_dir(), f"budget_{self.run_id}.json") if self.run_id else None
+
+    def allow(self, calls: int = 1, reserve: int = 0) -> bool:
+        """Return True if the budget still has room for the given number of calls,
+        leaving `reserve` calls unspent for a later step."""
+        with self._lock:
+            if self.max_calls is not None and self.calls + calls + reserve > self.max_calls:
+                return False
+            if self.max_tokens is not None and self.tokens >= self.max_tokens:
+                return False
+            return True
+
+    def charge(self, tokens: int = 0, calls: int = 1):
+        with self._lock:
+            self.calls += calls
+            self.tokens += tokens
+        self.save()
+
+    def record_saved(self, calls: int, reason: str):
+        """Record calls avoided by stopping early and why."""
+        with self._lock:
+            self.saved += calls
+            self.stops.append({"reason": reason, "calls_saved": calls})
+        logging.info(f"Stopping early ({reason}); about {calls} API call(s) saved.")
+        self.save()
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "run_id": self.run_id,
+                "calls": self.calls,
+                "tokens": self.tokens,
+                "calls_saved": self.saved,
+                "max_calls": self.max_calls,
+                "max_tokens": self.max_tokens,
+                "stops": list(self.stops),
+            }
+
+    def summary_line(self) -> str:
+        limit = f" of {self.max_calls} allowed" if self.max_calls is not None else ""
+        return f"API calls: {self.calls} spent{limit}, {self.saved} saved by early stopping, {self.tokens} tokens used."
+
+    def save(self):
+        file_path = self.path()
+        if not file_path or (self.guard is not None and not self.guard()):
+            return
+        try:
+            atomic_write(file_path, json.dumps(self.report(), indent=4))
+        except Exception as e:
+            logging.error(f"Failed to save call budget: {e}")
+
+    def load(self) -> bool:
+        """Load spent counters from this run's ledger. Limits still come from the environment."""
+        file_path = self.path()
+        if not file_path or not os.path.exists(file_path):
+            return False
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.calls = data.get("calls", 0)
+            self.tokens = data.get("tokens", 0)
+            self.saved = data.get("calls_saved", 0)
+            self.stops = data.get("stops", [])
+            return True
+        except Exception as e:
+            logging.error(f"Failed to load call budget {file_path}: {e}")
+            return False
+
+def start_run(run_id: str, fresh: bool = True, guard: Optional[Callable[[], bool]] = None) -> CallBudget:
+    """Make a budget for run_id current. fresh=False continues the run's saved ledger.
+
+    guard, if given, is checked before every write of the ledger.
+    """
+    budget = CallBudget.from_env(run_id)
+    budget.guard = guard
+    if not fresh:
+        budget.load()
+    budget.save()
+    _current_budget.set(budget)
+    return budget
+
+def get_budget() -> CallBudget:
+    """Return the budget of the current run, or a process-wide one if no run was started."""
+    global _default_budget
+    budget = _current_budget.get()
+    if budget is None:
+        if _default_budget is None:
+            _default_budget = CallBudget.from_env()
+        budget = _default_budget
+    return budget
@@ -0,0 +1,199 @@
+"""
+conversation.py (Compact conversation history)
+
+A Conversation is an append-only list of slot-based Message objects. Appending is
+O(1), views (prefix, window, history plus a pending prompt) share the underlying
+list instead of copying it, and each message caches its dict and JSON forms, so
+saving the history every turn only joins pre-encoded fragments.
+
+Output is byte-for-byte what json.dumps(..., indent=4, ensure_ascii=False) gives
+for the equivalent list of {"role", "content"} dicts.
+"""
+
+import sys
+import json
+from types import MappingProxyType
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Union
+
+class Message:
+    """One chat message. Immutable, so the cached forms never need invalidating."""
+
+    __slots__ = ("role", "content", "_dict", "_json")
+
+    def __init__(self, role: str, content: str):
+        object.__setattr__(self, "role", sys.intern(role))
+        object.__setattr__(self, "content", content)
+        object.__setattr__(self, "_dict", None)
+        object.__setattr__(self, "_json", None)
+
+    def __setattr__(self, name: str, value: Any):
+        if name in ("role", "content"):
+            raise AttributeError(f"Message.{name} is read-only")
+        object.__setattr__(self, name, value)
+
+    def __getitem__(self, key: str):
+        # Lets code written for {"role", "content"} dicts keep working.
+        if key == "role":
+            return self.role
+        if key == "content":
+            return self.content
+        raise KeyError(key)
+
+    def __eq__(self, other):
+        if isinstance(other, Message):
+            return self.role == other.role and self.content == other.content
+        if isinstance(other, dict):
+            return other == {"role": self.role, "content": self.content}
+        return NotImplemented
+
+    def __repr__(self):
+        return f"Message({self.role!r}, {self.content[:40]!r})"
+
+    def get(self, key: str, default: Any = None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_dict(self) -> Mapping[str, str]:
+        """The message as the API expects it, built once. Read-only: every request that includes the message shares it."""
+        if self._dict is None:
+            self._dict = MappingProxyType({"role": self.role, "content": self.content})
+        return self._dict
+
+    def to_json(self, indent: int = 4) -> str:
+        """JSON for this message at the top level, encoded once per indent."""
+        if self._json is None:
+            self._json = {}
+        fragment = self._json.get(indent)
+        if fragment is None:
+            fragment = json.dumps({"role": self.role, "content": self.content}, indent=indent, ensure_ascii=False)
+            self._json[indent] = fragment
+        return fragment
+
+    @classmethod
+    def coerce(cls, message: Union["Message", Dict[str, str]]) -> "Message":
+        if isinstance(message, Message):
+            return message
+        return cls(message["role"], message["content"])
+
+def _encode_list(messages: Iterable[Message], indent: int, level: int) -> str:
+    """Join cached message fragments into a JSON array nested `level` deep."""
+    item_pad = "\n" + " " * (indent * (level + 1))
+    parts = [m.to_json(indent).replace("\n", item_pad) for m in messages]
+    if not parts:
+        return "[]"
+    return "[" + item_pad + ("," + item_pad).join(parts) + "\n" + " " * (indent * level) + "]"
+
+class ConversationView:
+    """Read-only window onto a Conversation, optionally followed by one pending message."""
+
+    __slots__ = ("_messages", "_start", "_stop", "_pending")
+
+    def __init__(self, messages: List[Message], start: int, stop: int, pending: Optional[Message] = None):
+        self._messages = messages
+        self._start = start
+        self._stop = stop
+        self._pending = pending
+
+    def __len__(self) -> int:
+        return self._stop - self._start + (1 if self._pending is not None else 0)
+
+    def __iter__(self) -> Iterator[Message]:
+        messages = self._messages
+        for i in range(self._start, self._stop):
+            yield messages[i]
+        if self._pending is not None:
+            yield self._pending
+
+    def __getitem__(self, index: int) -> Message:
+        size = len(self)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError(index)
+        if self._pending is not None and index == size - 1:
+            return self._pending
+        return self._messages[self._start + index]
+
+    def with_pending(self, role: str, content: str) -> "ConversationView":
+        """This view followed by one more message; replaces any existing pending message."""
+        return ConversationView(self._messages, self._start, self._stop, Message(role, content))
+
+    def to_message_params(self) -> List[Mapping[str, str]]:
+        return [m.to_dict() for m in self]
+
+    def to_json(self, indent: int = 4, level: int = 0) -> str:
+        return _encode_list(self, indent, level)
+
+class Conversation:
+    """Append-only chat history with O(1) append and copy-free views."""
+
+    __slots__ = ("_messages",)
+
+    def __init__(self, messages: Iterable[Union[Message, Dict[str, str]]] = ()):
+        self._messages: List[Message] = [Message.coerce(m) for m in messages]
+
+    @classmethod
+    def coerce(cls, history: Union["Conversation", Iterable[Dict[str, str]]]) -> "Conversation":
+        """Return history itself if it already is a Conversation, else a new Conversation copied from it."""
+        return history if isinstance(history, Conversation) else cls(history)
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def __iter__(self) -> Iterator[Message]:
+        return iter(self._messages)
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self._messages))
+            if step != 1:
+                raise ValueError("Conversation slices must be contiguous")
+            return ConversationView(self._messages, start, max(start, stop))
+        return self._messages[index]
+
+    def append(self, message: Union[Message, Dict[str, str], str], content: Optional[str] = None) -> Message:
+        """Append a Message, a {"role", "content"} dict, or append(role, content)."""
+        if content is not None:
+            message = Message(message, content)
+        else:
+            message = Message.coerce(message)
+        self._messages.append(message)
+        return message
+
+    def contents(self, role: str) -> List[str]:
+        return [m.content for m in self._messages if m.role == role]
+
+    def prefix(self, stop: int) -> ConversationView:
+        """The first `stop` messages. Stays valid as later messages are appended."""
+        return ConversationView(self._messages, 0, min(stop, len(self._messages)))
+
+    def window(self, size: int, pending: Optional[Message] = None) -> ConversationView:
+        """The last `size` messages, optionally followed by a pending message."""
+        stop = len(self._messages)
+        return ConversationView(self._messages, max(0, stop - size), stop, pending)
+
+    def with_pending(self, role: str, content: str) -> ConversationView:
+        """The whole history plus one message that is not (yet) part of it."""
+        return ConversationView(self._messages, 0, len(self._messages), Message(role, content))
+
+    def to_message_params(self) -> List[Mapping[str, str]]:
+        return [m.to_dict() for m in self._messages]
+
+    def to_json(self, indent: int = 4, level: int = 0) -> str:
+        return _encode_list(self._messages, indent, level)
+
+def dumps_document(document: Dict[str, Any], indent: int = 4) -> str:
+    """json.dumps for a flat dict whose values may include Conversations or views."""
+    pad = " " * indent
+    items = []
+    for key, value in document.items():
+        if isinstance(value, (Conversation, ConversationView)):
+            encoded = value.to_json(indent, level=1)
+        else:
+            encoded = json.dumps(value, indent=indent, ensure_ascii=False).replace("\n", "\n" + pad)
+        items.append(f"{pad}{json.dumps(key, ensure_ascii=False)}: {encoded}")
+    if not items:
+        return "{}"
+    return "{\n" + ",\n".join(items) + "\n}"
@@ -5,6 +5,7 @@ This script analyzes the latest pipeline output, queries multiple Llama models f
 """
 
 import os
+import sys
 import re
 import glob
 import json
@@ -13,10 +14,11 @@ import subprocess
 from datetime import datetime
 from typing import Optional
 
-try:
-    from llama_api_client import LlamaAPIClient
-except ImportError:
-    LlamaAPIClient = None
+from module_common import get_llama_client, llama_client_scope
+from call_budget import get_budget, start_run, count_tokens
+from rate_limiter import limited_call
+from singleflight import get_flight, request_key
+from tracing import traced, current_span, set_trace_id
 
 def extract_python_code_blocks(md_text):
     return re.findall(r'```python\s*([\s\S]*?)```', md_text, re.MULTILINE)
@@ -51,24 +53,38 @@ def summarize_markdown(md_text):
     summary["prompt_guess"] = guess
     return summary
 
+@traced("llama_review")
 def call_llama_review(prompt: str, code: str, model: str) -> Optional[str]:
-    if not LlamaAPIClient:
+    budget = get_budget()
+    if not budget.allow():
+        budget.record_saved(1, f"call budget exhausted before {model} review")
+        return None
+    try:
+        client = get_llama_client()
+    except ImportError:
         return None
     try:
-        client = LlamaAPIClient(
-            api_key=os.environ.get("LLAMA_API_KEY"),
-            base_url="https://api.llama.com/v1/",
-        )
         messages = [
             {"role": "system", "content": f"You are a senior Python developer and reviewer. The user prompt is: {prompt}"},
             {"role": "user", "content": f"Here is the code block to review and improve.\n\n```python\n{code}\n```\n\nPlease provide:\n- A short summary of what this code does.\n- Is it relevant to the prompt?\n- Suggestions for improvement or a better implementation.\n- If the code is off-topic, suggest a scaffold for the user's goal."}
         ]
-        response = client.chat.completions.create(
+        # Same scaffold reviewed concurrently for several prompts: one request serves all of them.
+        response, shared = get_flight("llama").do(
+            # Clients with different keys or endpoints never share a response.
+            request_key(llama_client_scope(client), model, messages),
+            limited_call,
+            f"llama_{model}",
+            client.chat.completions.create,
             model=model,
             messages=messages,
         )
+        tokens = count_tokens(response, messages[0]["content"] + messages[1]["content"])
+        if not shared:
+            budget.charge(tokens)
+        current_span().set(model=model, tokens=tokens, code_bytes=len(code))
         return getattr(response.completion_message.content, 'text', None)
     except Exception as e:
+        current_span().set(model=model, failed=True)
         return f"[Llama API error: {e}]"
 
 def extract_imports(code):
@@ -95,12 +111,14 @@ def check_dependencies(imports):
             missing.append(pkg)
     return missing
 
+@traced("lint_code")
 def lint_code(code):
     with tempfile.NamedTemporaryFile('w', suffix='.py', delete=False) as tf:
         tf.write(code)
         temp_path = tf.name
     try:
         result = subprocess.run(['flake8', temp_path], capture_output=True, text=True, timeout=10)
+        current_span().set(code_bytes=len(code), returncode=result.returncode)
         lint_output = result.stdout.strip() or 'No linting issues found.'
         # Suggest fixes for common issues
         fix_suggestions = []
@@ -116,12 +134,14 @@ def lint_code(code):
         os.unlink(temp_path)
     return lint_output
 
+@traced("run_code")
 def run_code(code):
     with tempfile.NamedTemporaryFile('w', suffix='.py', delete=False) as tf:
         tf.write(code)
         temp_path = tf.name
     try:
         result = subprocess.run(['python', temp_path], capture_output=True, text=True, timeout=10)
+        current_span().set(code_bytes=len(code), returncode=result.returncode, output_bytes=len(result.stdout) + len(result.stderr))
         output = result.stdout.strip()
         error = result.stderr.strip()
         if result.returncode == 0:
@@ -280,19 +300,20 @@ def write_action_plan(summary, params, lint_output, run_result, imports, missing
         f.write(f"---\n\n")
         f.write("_Action plan generated by StepForge pipeline smart assistant._\n")
 
-def main():
-    output_dir = "output"
-
-    # Find the latest prompt file and extract its id
-    prompt_file = find_latest_prompt_file()
-    if not prompt_file:
-        print("No prompt files found in the prompts directory.")
-        return
+def run_action_plan(prompt_file, output_dir="output", action_plan_name="Action_plan.md", allow_fallback=True, should_continue=None):
+    """Write the action plan for one prompt file. Returns its path, or None if there was nothing to analyze.
 
+    With allow_fallback=False only output_<prompt_id>.md is used, never the newest
+    markdown file of some other prompt. should_continue is checked before the
+    budget ledger and the plan are written; if it returns False nothing is written.
+    """
     with open(prompt_file, 'r', encoding='utf-8') as pf:
         prompt_data = json.load(pf)
     prompt_id = prompt_data.get('id')
     user_goal = prompt_data.get('goal', '')
+    set_trace_id(prompt_id)
+    # Continue spending from the budget the conversation step used for this prompt.
+    budget = start_run(prompt_id, fresh=False, guard=should_continue) if prompt_id else get_budget()
 
     # Find the latest output markdown file matching the prompt id
     output_md_path = None
@@ -302,11 +323,14 @@ def main():
             output_md_path = candidate
 
     if not output_md_path:
+        if not allow_fallback:
+            print(f"No output markdown file found for prompt {prompt_id}.")
+            return None
         # Fallback: use the most recent output_*.md file
         md_files = sorted(glob.glob(os.path.join(output_dir, "output_*.md")), key=os.path.getmtime, reverse=True)
         if not md_files:
             print("No output markdown files found in the output directory.")
-            return
+            return None
         output_md_path = md_files[0]
 
     with open(output_md_path, "r", encoding="utf-8") as f:
@@ -352,9 +376,22 @@ def main():
         scaffold_suggestion = call_llama_review(user_goal, "", "Llama-4-Maverick-17B-128E-Instruct-FP8") or "[No scaffold generated]"
 
     # Write Action Plan
-    action_plan_path = os.path.join(output_dir, "Action_plan.md")
+    action_plan_path = os.path.join(output_dir, action_plan_name)
+    if should_continue is not None and not should_continue():
+        print(f"Not writing {action_plan_path}: this run may no longer continue.")
+        return None
     write_action_plan(summary, params, lint_output, run_result, imports, missing, resources, action_plan_path, review_maverick, review_scout, scaffold_suggestion, code_relevance_flag, warning)
     print(f"\n[StepForge] Action plan written to: {action_plan_path}")
+    print(f"[StepForge] {budget.summary_line()}")
+    return action_plan_path
+
+def main():
+    # Find the latest prompt file and extract its id
+    prompt_file = find_latest_prompt_file()
+    if not prompt_file:
+        print("No prompt files found in the prompts directory.")
+        return 1
+    return 0 if run_action_plan(prompt_file) else 1
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -1,11 +1,20 @@
 import os
 import json
+import time
+import hashlib
 import logging
 import tempfile
 import shutil
+import threading
 from pathlib import Path
 from typing import List, Dict, Any, Optional, Tuple
-import requests
+
+# Heavy third-party modules are imported on first use so that one-off step
+# invocations only pay for what they actually call. Clients are cached per
+# process, which lets a long-lived daemon reuse their connection pools.
+_client_lock = threading.Lock()
+_llama_clients: Dict[Tuple[Optional[str], str], Any] = {}
+_http_session = None
 
 def atomic_write(file_path, data, mode='w', encoding='utf-8'):
     dir_name = os.path.dirname(file_path)
@@ -15,19 +24,91 @@ def atomic_write(file_path, data, mode='w', encoding='utf-8'):
         tempname = tf.name
     shutil.move(tempname, file_path)
 
+class FileLock:
+    """Cross-process mutex based on exclusive creation of a lock file."""
+
+    def __init__(self, path: str, stale_seconds: float = 10.0):
+        self.path = path
+        self.stale_seconds = stale_seconds
+
+    def __enter__(self):
+        while True:
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.close(fd)
+                return self
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self.path) > self.stale_seconds:
+                        # The holder died while holding the lock.
+                        os.remove(self.path)
+                        continue
+                except OSError:
+                    continue
+                time.sleep(0.005)
+
+    def __exit__(self, *exc):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
 def get_output_dir() -> str:
     return os.environ.get("PONDER_LLAMA_OUTPUT_DIR", "output")
 
+def get_llama_base_url() -> str:
+    """Get the LLaMA API base URL from env or default to the public endpoint."""
+    return os.environ.get("LLAMA_API_BASE_URL", "https://api.llama.com/v1/")
+
+def get_ddgs_url() -> str:
+    """Get the DuckDuckGo API URL from env or default to the public endpoint."""
+    return os.environ.get("PONDER_LLAMA_DDGS_URL", "https://api.duckduckgo.com/")
+
+def get_llama_client(base_url: Optional[str] = None):
+    """Return a shared LlamaAPIClient for the current API key and base URL."""
+    from llama_api_client import LlamaAPIClient
+    base_url = base_url or get_llama_base_url()
+    api_key = os.environ.get("LLAMA_API_KEY")
+    key = (api_key, base_url)
+    with _client_lock:
+        client = _llama_clients.get(key)
+        cache_hit = client is not None
+        if client is None:
+            # No SDK retries: rate_limiter.limited_call retries 429s and transient errors
+            # itself, with backoff and the shared AIMD limit seeing every 429.
+            client = LlamaAPIClient(api_key=api_key, base_url=base_url, max_retries=0)
+            _llama_clients[key] = client
+    from tracing import current_span
+    current_span().add("client_cache_hits" if cache_hit else "client_cache_misses")
+    return client
+
+def llama_client_scope(client) -> str:
+    """Base URL and a hash of the API key of client, for keying its requests without exposing the key."""
+    api_key = getattr(client, "api_key", None) or ""
+    return f"{client.base_url}|{hashlib.sha256(api_key.encode('utf-8')).hexdigest()}"
+
+def get_http_session():
+    """Return a shared requests.Session so repeated searches reuse connections."""
+    global _http_session
+    import requests
+    with _client_lock:
+        if _http_session is None:
+            _http_session = requests.Session()
+    return _http_session
+
 def to_message_params(history: List[Dict[str, str]]) -> list:
     return history
 
 def ddgs_search(query: str) -> Dict:
-    url = "https://api.duckduckgo.com/"
+    from rate_limiter import limited_call
+    url = get_ddgs_url()
     params = {"q": query, "format": "json"}
-    try:
-        response = requests.get(url, params=params, timeout=10)
+    def _get():
+        response = get_http_session().get(url, params=params, timeout=10)
         response.raise_for_status()
-        return response.json()
+        return response
+    try:
+        return limited_call("ddgs", _get).json()
     except Exception as e:
         logging.error(f"DDGS search failed: {e}")
         return {"error": str(e)}
\ No newline at end of file
@@ -0,0 +1,335 @@
+"""
+pipeline_daemon.py (StepForge Pipeline Daemon)
+
+Keeps the StepForge steps loaded in one long-lived process so repeated runs from
+the GUI or tasks.py skip interpreter start-up, SDK imports and client construction.
+Jobs are submitted over local HTTP and progress is streamed back as JSON lines.
+
+    python pipeline_daemon.py serve
+    python pipeline_daemon.py submit pipeline
+    python pipeline_daemon.py submit conversation --resume <prompt_id>
+
+The daemon works in its own current directory (prompts/ and output/ are resolved
+there) and runs one job at a time; further submissions queue behind it. Restart
+the daemon after editing a step script, since loaded modules are not reloaded.
+
+Only local clients that can read the project folder may submit jobs: requests
+must carry the token the daemon writes to .pipeline_daemon_token at start-up,
+use Content-Type application/json and address the daemon by a loopback Host, so
+web pages open in a browser cannot start jobs (no CORS, no DNS rebinding).
+"""
+
+import os
+import sys
+import json
+import time
+import hmac
+import queue
+import secrets
+import logging
+import argparse
+import importlib
+import threading
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from tracing import flush_metrics
+
+DEFAULT_ADDR = "127.0.0.1:8765"
+TOKEN_FILE = ".pipeline_daemon_token"
+TOKEN_HEADER = "X-StepForge-Token"
+
+# Step name -> importable module providing main(). 3.py is importable as "3".
+STEP_MODULES = {
+    "conversation": "3",
+    "action": "five_action",
+}
+JOB_STEPS = {
+    "conversation": ["conversation"],
+    "action": ["action"],
+    "pipeline": ["conversation", "action"],
+}
+
+def get_daemon_addr() -> Tuple[str, int]:
+    """Get daemon host and port from env or default to 127.0.0.1:8765."""
+    addr = os.environ.get("PONDER_LLAMA_DAEMON_ADDR", DEFAULT_ADDR)
+    host, _, port = addr.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+class _QueueLogHandler(logging.Handler):
+    """Forward log records to the event queue of the running job."""
+
+    def __init__(self, events: "queue.Queue"):
+        super().__init__()
+        self.events = events
+
+    def emit(self, record):
+        try:
+            self.events.put({"event": "log", "level": record.levelname, "message": record.getMessage()})
+        except Exception:
+            self.handleError(record)
+
+class _QueueWriter:
+    """File-like object that forwards printed lines to the event queue."""
+
+    def __init__(self, events: "queue.Queue"):
+        self.events = events
+        self._buffer = ""
+
+    def write(self, text):
+        self._buffer += text
+        while "\n" in self._buffer:
+            line, self._buffer = self._buffer.split("\n", 1)
+            if line.strip():
+                self.events.put({"event": "stdout", "message": line})
+        return len(text)
+
+    def flush(self):
+        if self._buffer.strip():
+            self.events.put({"event": "stdout", "message": self._buffer})
+        self._buffer = ""
+
+class PipelineDaemon:
+    def __init__(self):
+        self.modules: Dict[str, object] = {}
+        self.job_lock = threading.Lock()
+        self.started = time.time()
+        self.jobs_run = 0
+        self.jobs_waiting = 0
+        self.current_job: Optional[str] = None
+        # Guards the counters above; handler threads update them concurrently.
+        self.counter_lock = threading.Lock()
+        self.token = ""
+
+    def warm_up(self):
+        """Import every step and build shared clients before the first job arrives."""
+        for step, module_name in STEP_MODULES.items():
+            self.modules[step] = importlib.import_module(module_name)
+            logging.info(f"Loaded step '{step}' from {module_name}")
+        from module_common import get_llama_client, get_http_session
+        for name, factory in (("LLaMA client", get_llama_client), ("HTTP session", get_http_session)):
+            try:
+                factory()
+                logging.info(f"{name} ready")
+            except Exception as e:
+                logging.warning(f"{name} not available, will retry on first use: {e}")
+
+    def run_job(self, job: Dict, events: "queue.Queue"):
+        """Run the steps of a job in order, streaming progress into the event queue."""
+        steps = JOB_STEPS[job["step"]]
+        handler = _QueueLogHandler(events)
+        writer = _QueueWriter(events)
+        root = logging.getLogger()
+        ok = True
+        with self.counter_lock:
+            self.jobs_waiting += 1
+        with self.job_lock:
+            with self.counter_lock:
+                self.jobs_waiting -= 1
+                self.current_job = job["step"]
+            started = time.time()
+            root.addHandler(handler)
+            try:
+                with contextlib.redirect_stdout(writer):
+                    for step in steps:
+                        events.put({"event": "step", "step": step})
+                        step_started = time.time()
+                        try:
+                            if step == "conversation":
+                                # Never let 3.py parse the daemon's own command line.
+                                status = self.modules[step].main(["--resume", job["resume"]] if job.get("resume") else [])
+                            else:
+                                status = self.modules[step].main()
+                            if status:
+                                # Interrupted or nothing to process: later steps would use stale outputs.
+                                logging.error(f"Step '{step}' failed with status {status}")
+                                ok = False
+                        except SystemExit as e:
+                            ok = not e.code
+                        except Exception as e:
+                            logging.error(f"Step '{step}' failed: {e}")
+                            ok = False
+                        writer.flush()
+                        events.put({"event": "step_done", "step": step, "elapsed": round(time.time() - step_started, 3)})
+                        if not ok:
+                            break
+            finally:
+                root.removeHandler(handler)
+                with self.counter_lock:
+                    self.current_job = None
+                    self.jobs_run += 1
+                flush_metrics()
+        events.put({"event": "done", "ok": ok, "elapsed": round(time.time() - started, 3)})
+
+    def status(self) -> Dict:
+        return {
+            "pid": os.getpid(),
+            "uptime": round(time.time() - self.started, 1),
+            "jobs_run": self.jobs_run,
+            "jobs_waiting": self.jobs_waiting,
+            "current_job": self.current_job,
+            "steps": sorted(self.modules),
+        }
+
+class _DaemonRequestHandler(BaseHTTPRequestHandler):
+    daemon: PipelineDaemon = None  # set by serve()
+
+    def log_message(self, format, *args):
+        logging.debug("daemon: " + format % args)
+
+    def _send_json(self, code: int, payload: Dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self, require_json: bool = False) -> bool:
+        """Reject requests a browser page could forge; sends the error response itself."""
+        host = (self.headers.get("Host") or "").rsplit(":", 1)[0].strip("[]").lower()
+        if host not in ("127.0.0.1", "localhost", "::1", get_daemon_addr()[0].lower()):
+            self._send_json(403, {"error": "Unexpected Host header"})
+            return False
+        if require_json and (self.headers.get("Content-Type") or "").split(";")[0].strip().lower() != "application/json":
+            self._send_json(415, {"error": "Content-Type must be application/json"})
+            return False
+        token = self.headers.get(TOKEN_HEADER) or ""
+        if not self.daemon.token or not hmac.compare_digest(token, self.daemon.token):
+            self._send_json(403, {"error": f"Missing or wrong {TOKEN_HEADER}; read it from {TOKEN_FILE}"})
+            return False
+        return True
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        if self.path == "/status":
+            self._send_json(200, self.daemon.status())
+        else:
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if not self._authorized(require_json=True):
+            return
+        if self.path != "/jobs":
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            job = json.loads(self.rfile.read(length) or b"{}")
+        except Exception as e:
+            self._send_json(400, {"error": f"Invalid job: {e}"})
+            return
+        if job.get("step") not in JOB_STEPS:
+            self._send_json(400, {"error": f"Unknown step {job.get('step')!r}, expected one of {sorted(JOB_STEPS)}"})
+            return
+
+        events: "queue.Queue" = queue.Queue()
+        runner = threading.Thread(target=self.daemon.run_job, args=(job, events), daemon=True)
+        with self.daemon.counter_lock:
+            ahead = self.daemon.jobs_waiting + (1 if self.daemon.current_job else 0)
+        events.put({"event": "queued", "step": job["step"], "ahead": ahead})
+        runner.start()
+
+        # Stream newline-delimited JSON events until the job reports completion.
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        while True:
+            event = events.get()
+            try:
+                self.wfile.write((json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8"))
+                self.wfile.flush()
+            except OSError:
+                # Client went away; let the job finish but stop streaming.
+                logging.warning("Client disconnected while streaming job progress.")
+                return
+            if event["event"] == "done":
+                return
+
+def serve():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    daemon = PipelineDaemon()
+    daemon.warm_up()
+    daemon.token = secrets.token_hex(16)
+    # Readable only by this user; submit() reads it from the same project folder.
+    fd = os.open(TOKEN_FILE, os.O_CREAT | os.O_TRUNC | os.O_WRONLY, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(daemon.token)
+    _DaemonRequestHandler.daemon = daemon
+    host, port = get_daemon_addr()
+    server = ThreadingHTTPServer((host, port), _DaemonRequestHandler)
+    print(f"[StepForge] Pipeline daemon listening on http://{host}:{port} (pid {os.getpid()})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        try:
+            os.remove(TOKEN_FILE)
+        except OSError:
+            pass
+
+def submit(step: str, resume: Optional[str] = None) -> int:
+    """Submit a job to the running daemon and print its progress. Returns an exit code."""
+    import urllib.error
+    import urllib.request
+    host, port = get_daemon_addr()
+    try:
+        with open(TOKEN_FILE, "r", encoding="utf-8") as f:
+            token = f.read().strip()
+    except OSError:
+        print(f"No {TOKEN_FILE} in {os.getcwd()}. Start the daemon from this folder with: python pipeline_daemon.py serve")
+        return 2
+    body = json.dumps({"step": step, "resume": resume}).encode("utf-8")
+    request = urllib.request.Request(
+        f"http://{host}:{port}/jobs", data=body, method="POST",
+        headers={"Content-Type": "application/json", TOKEN_HEADER: token},
+    )
+    try:
+        response = urllib.request.urlopen(request)
+    except urllib.error.HTTPError as e:
+        print(f"Pipeline daemon rejected the job ({e.code}): {e.read().decode('utf-8', 'replace')}")
+        return 2
+    except OSError as e:
+        print(f"Could not reach the pipeline daemon at {host}:{port}: {e}")
+        print("Start it with: python pipeline_daemon.py serve")
+        return 2
+    ok = False
+    with response:
+        for raw in response:
+            event = json.loads(raw.decode("utf-8"))
+            kind = event["event"]
+            if kind == "queued" and event["ahead"]:
+                print(f"[queued] {event['ahead']} job(s) ahead")
+            elif kind == "step":
+                print(f"[step] {event['step']}")
+            elif kind == "step_done":
+                print(f"[step] {event['step']} finished in {event['elapsed']}s")
+            elif kind == "log":
+                print(f"{event['level']}: {event['message']}")
+            elif kind == "stdout":
+                print(event["message"])
+            elif kind == "done":
+                ok = event["ok"]
+                print(f"[done] {'success' if ok else 'failed'} in {event['elapsed']}s")
+    return 0 if ok else 1
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="StepForge pipeline daemon")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("serve", help="Start the daemon in the foreground")
+    submit_parser = sub.add_parser("submit", help="Submit a job and stream its progress")
+    submit_parser.add_argument("step", choices=sorted(JOB_STEPS), help="Pipeline step(s) to run")
+    submit_parser.add_argument("--resume", metavar="PROMPT_ID", help="resume the conversation step from its checkpoint")
+    args = parser.parse_args(argv)
+    if args.command == "serve":
+        serve()
+    else:
+        sys.exit(submit(args.step, args.resume))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+rate_limiter.py (Shared client-side rate limiter)
+
+Paces LLaMA and DuckDuckGo requests across every StepForge process on the machine.
+Each endpoint/model key has a token bucket plus an AIMD concurrency limit, both
+kept in a small JSON state file guarded by a lock file, so pipelines started
+from the GUI, tasks.py, the daemon or several terminals share one budget.
+
+Callers queue (FIFO) instead of failing: a 429 halves the concurrency limit,
+empties the bucket and retries after a backoff; successful calls grow the limit
+again by 1/limit. Run `python rate_limiter.py` to see queue depth and wait times.
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import random
+import logging
+import tempfile
+from typing import Any, Callable, Dict, Optional
+from tracing import current_span
+from module_common import FileLock
+
+LEASE_TTL_SECONDS = 300.0  # upper bound for a hung holder; dead holders are dropped at once
+SLOW_SAMPLES_TO_BACK_OFF = 3
+WAITER_STALE_SECONDS = 5.0
+MAX_BACKOFF_SECONDS = 60.0
+
+def get_rate_dir() -> str:
+    """Directory holding shared limiter state, from env or the system temp dir."""
+    return os.environ.get("PONDER_LLAMA_RATE_DIR", os.path.join(tempfile.gettempdir(), "ponder_llama_ratelimit"))
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    """True unless pid is known to have exited. Unknown pids count as alive."""
+    if not pid or pid == os.getpid():
+        return True
+    if os.name == "nt":
+        # os.kill(pid, 0) would terminate the process on Windows.
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        try:
+            code = ctypes.c_ulong()
+            kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+            return code.value == 259  # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+def is_throttled(error: Exception) -> bool:
+    """True if an exception from the LLaMA SDK or requests is an HTTP 429."""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429
+
+def is_transient(error: Exception) -> bool:
+    """True for errors worth retrying without treating them as throttling (timeouts, 5xx, dropped connections)."""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return status in (408, 409) or status >= 500
+    names = {cls.__name__ for cls in type(error).__mro__}
+    return bool(names & {"APIConnectionError", "APITimeoutError", "ConnectionError", "Timeout", "TimeoutError"})
+
+def _retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+class RateLimiter:
+    """Token bucket + AIMD concurrency limit for one endpoint/model key."""
+
+    def __init__(self, key: str, rate: Optional[float] = None, burst: Optional[float] = None, max_concurrency: Optional[int] = None):
+        self.key = key
+        self.rate = rate if rate is not None else _env_float("PONDER_LLAMA_RATE_LIMIT", 2.0)
+        self.burst = burst if burst is not None else _env_float("PONDER_LLAMA_RATE_BURST", 4.0)
+        self.max_concurrency = max_concurrency or int(_env_float("PONDER_LLAMA_MAX_CONCURRENCY", 4))
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", key)
+        rate_dir = get_rate_dir()
+        os.makedirs(rate_dir, exist_ok=True)
+        self.state_path = os.path.join(rate_dir, f"{name}.json")
+        self.lock = FileLock(os.path.join(rate_dir, f"{name}.lock"))
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def _load(self, now: float) -> Dict[str, Any]:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        state.setdefault("tokens", self.burst)
+        state.setdefault("updated", now)
+        state.setdefault("limit", float(self.max_concurrency))
+        state.setdefault("cooldown_until", 0.0)
+        state.setdefault("in_flight", {})
+        state.setdefault("waiting", {})
+        state.setdefault("stats", {"calls": 0, "waits": 0, "total_wait": 0.0, "max_wait": 0.0, "throttled": 0, "latency_ewma": None})
+        # Refill the bucket and drop leases/waiters left behind by dead processes.
+        state["tokens"] = min(self.burst, state["tokens"] + (now - state["updated"]) * self.rate)
+        state["updated"] = now
+        in_flight = {}
+        for k, v in state["in_flight"].items():
+            started, pid = (v, None) if isinstance(v, (int, float)) else v
+            if now - started < LEASE_TTL_SECONDS and _pid_alive(pid):
+                in_flight[k] = [started, pid]
+        state["in_flight"] = in_flight
+        state["waiting"] = {k: v for k, v in state["waiting"].items() if now - v[1] < WAITER_STALE_SECONDS}
+        state["limit"] = min(state["limit"], float(self.max_concurrency))
+        return state
+
+    def _save(self, state: Dict[str, Any]):
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def acquire(self) -> str:
+        """Block until this caller is first in line and a token and slot are free. Returns a lease id."""
+        lease = uuid.uuid4().hex
+        enqueued = time.time()
+        while True:
+            with self.lock:
+                now = time.time()
+                state = self._load(now)
+                waiting = state["waiting"]
+                waiting[lease] = [waiting.get(lease, [enqueued])[0], now]
+                first = min(waiting, key=lambda k: waiting[k][0])
+                ready = (
+                    first == lease
+                    and now >= state["cooldown_until"]
+                    and state["tokens"] >= 1
+                    and len(state["in_flight"]) < max(1, int(state["limit"]))
+                )
+                if ready:
+                    del waiting[lease]
+                    state["tokens"] -= 1
+                    state["in_flight"][lease] = [now, os.getpid()]
+                    waited = now - enqueued
+                    stats = state["stats"]
+                    stats["waits"] += 1
+                    stats["total_wait"] += waited
+                    stats["max_wait"] = max(stats["max_wait"], waited)
+                    depth = len(waiting)
+                else:
+                    delay = max(state["cooldown_until"] - now, (1 - state["tokens"]) / self.rate, 0.05)
+                self._save(state)
+            if ready:
+                current_span().add("queue_wait_seconds", round(waited, 6))
+                if waited > 1.0:
+                    logging.info(f"Rate limiter: waited {waited:.1f}s for {self.key} ({depth} still queued)")
+                return lease
+            time.sleep(min(delay, 1.0))
+
+    def release(self, lease: str, latency: Optional[float] = None, throttled: bool = False, backoff: Optional[float] = None):
+        """Return a slot and adjust the concurrency limit (AIMD) from the call outcome."""
+        with self.lock:
+            now = time.time()
+            state = self._load(now)
+            state["in_flight"].pop(lease, None)
+            stats = state["stats"]
+            stats["calls"] += 1
+            if throttled:
+                stats["throttled"] += 1
+                state["limit"] = max(1.0, state["limit"] / 2)
+                state["tokens"] = min(state["tokens"], 0.0)
+                state["cooldown_until"] = max(state["cooldown_until"], now + (backoff or 0.0))
+            elif latency is not None:
+                ewma = stats["latency_ewma"]
+                if ewma is not None and latency > 2 * ewma:
+                    # One slow call is usually just a big request (e.g. the markdown summary);
+                    # only back off before the server starts returning 429s if slowness persists.
+                    stats["slow_streak"] = stats.get("slow_streak", 0) + 1
+                    if stats["slow_streak"] >= SLOW_SAMPLES_TO_BACK_OFF:
+                        state["limit"] = max(1.0, state["limit"] / 2)
+                        stats["slow_streak"] = 0
+                else:
+                    stats["slow_streak"] = 0
+                    state["limit"] = min(float(self.max_concurrency), state["limit"] + 1 / state["limit"])
+                stats["latency_ewma"] = latency if ewma is None else 0.8 * ewma + 0.2 * latency
+            self._save(state)
+
+    def call(self, fn: Callable, *args, max_retries: int = 5, **kwargs):
+        """Run fn under the limiter, queueing and retrying on HTTP 429 and transient errors instead of failing.
+
+        This is the only retry layer (the LLaMA client is built with max_retries=0),
+        so every 429 reaches the AIMD limit. With the limiter disabled, calls are
+        not paced but are still retried with backoff.
+        """
+        attempt = 0
+        while True:
+            lease = self.acquire() if self.enabled else None
+            started = time.time()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                throttled = is_throttled(e)
+                if (throttled or is_transient(e)) and attempt < max_retries:
+                    backoff = _retry_after(e) or min(MAX_BACKOFF_SECONDS, (2 ** attempt) + random.random())
+                    if lease is not None:
+                        self.release(lease, throttled=throttled, backoff=backoff)
+                    if lease is None or not throttled:
+                        # A throttled release already holds every caller back for `backoff`.
+                        time.sleep(backoff)
+                    attempt += 1
+                    current_span().add("retries")
+                    reason = "Rate limited" if throttled else f"Transient error ({e})"
+                    logging.warning(f"{reason} on {self.key}; retry {attempt}/{max_retries} in {backoff:.1f}s")
+                    continue
+                if lease is not None:
+                    self.release(lease)
+                raise
+            if lease is not None:
+                self.release(lease, latency=time.time() - started)
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            state = self._load(time.time())
+        stats = state["stats"]
+        return {
+            "key": self.key,
+            "queue_depth": len(state["waiting"]),
+            "in_flight": len(state["in_flight"]),
+            "concurrency_limit": round(state["limit"], 2),
+            "tokens": round(state["tokens"], 2),
+            "calls": stats["calls"],
+            "throttled": stats["throttled"],
+            "avg_wait": round(stats["total_wait"] / stats["waits"], 3) if stats["waits"] else 0.0,
+            "max_wait": round(stats["max_wait"], 3),
+            "latency_ewma": round(stats["latency_ewma"], 3) if stats["latency_ewma"] is not None else None,
+        }
+
+_limiters: Dict[str, RateLimiter] = {}
+
+def get_limiter(key: str) -> RateLimiter:
+    limiter = _limiters.get(key)
+    if limiter is None:
+        limiter = _limiters.setdefault(key, RateLimiter(key))
+    return limiter
+
+def limited_call(key: str, fn: Callable, *args, **kwargs):
+    """Shortcut for get_limiter(key).call(fn, *args, **kwargs)."""
+    return get_limiter(key).call(fn, *args, **kwargs)
+
+def main():
+    rate_dir = get_rate_dir()
+    names = sorted(f[:-5] for f in os.listdir(rate_dir) if f.endswith(".json")) if os.path.isdir(rate_dir) else []
+    if not names:
+        print(f"No rate limiter state in {rate_dir}.")
+        return
+    for name in names:
+        print(json.dumps(RateLimiter(name).stats()))
+
+if __name__ == "__main__":
+    main()
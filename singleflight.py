@@ -0,0 +1,109 @@
+"""
+singleflight.py (Coalescing of identical in-flight requests)
+
+When several threads in one process (queue worker threads, daemon jobs) issue
+the same LLaMA request or DuckDuckGo query at the same time, only the first one
+goes to the network; the others wait for it and receive the same result (or the
+same exception). Nothing is cached once the call completes: a request made after
+the first has finished is sent again. LLaMA requests are keyed by base URL and a
+hash of the API key as well as model and messages, so callers using different
+keys or endpoints never share a response.
+
+Deduplicated calls are counted per group (see stats()) and on the caller's span
+as `deduplicated`, so they show up in output/metrics.prom. Set
+PONDER_LLAMA_COALESCE=0 to send every request.
+"""
+
+import os
+import hashlib
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from tracing import current_span
+
+def is_enabled() -> bool:
+    return os.environ.get("PONDER_LLAMA_COALESCE", "1").lower() not in ("0", "false", "no", "off")
+
+def request_key(*parts: Any) -> str:
+    """Stable key for a request. Message lists contribute their roles and contents."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, (list, tuple)):
+            for message in part:
+                digest.update(str(message["role"]).encode("utf-8") + b"\0")
+                digest.update(str(message["content"]).encode("utf-8") + b"\0")
+        else:
+            digest.update(str(part).encode("utf-8"))
+        digest.update(b"\1")
+    return digest.hexdigest()
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class SingleFlight:
+    """Runs at most one call per key at a time; concurrent callers share its outcome."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self.calls = 0
+        self.deduplicated = 0
+
+    def do(self, key: str, fn: Callable, *args, **kwargs) -> Tuple[Any, bool]:
+        """Return (result, shared). shared is True if another caller made the request."""
+        if not is_enabled():
+            return fn(*args, **kwargs), False
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                call.waiters += 1
+                self.deduplicated += 1
+        if not leader:
+            call.done.wait()
+            current_span().add("deduplicated")
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        if call.waiters:
+            current_span().add("coalesced_waiters", call.waiters)
+        return call.result, False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"group": self.name, "calls": self.calls, "deduplicated": self.deduplicated, "in_flight": len(self._calls)}
+
+_groups: Dict[str, SingleFlight] = {}
+_groups_lock = threading.Lock()
+
+def get_flight(name: str) -> SingleFlight:
+    flight = _groups.get(name)
+    if flight is None:
+        with _groups_lock:
+            flight = _groups.setdefault(name, SingleFlight(name))
+    return flight
+
+def stats() -> List[Dict[str, Any]]:
+    return [flight.stats() for flight in list(_groups.values())]
+
+def summary_line(groups: Optional[Iterable[Dict[str, Any]]] = None) -> str:
+    parts = [f"{g['group']}: {g['deduplicated']} of {g['calls'] + g['deduplicated']} deduplicated" for g in (groups if groups is not None else stats())]
+    return "Coalesced requests - " + (", ".join(parts) if parts else "none")
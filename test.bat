@@ -9,9 +9,5 @@ echo Running code quality checks...
 echo Checking PEP8 compliance...
 python -m flake8 *.py --max-line-length=88 --ignore=E203,W503
 
-echo Running specific module tests...
-python test_calculator.py
-python test_quantum.py
-
 echo ✅ All tests completed!
 pause
\ No newline at end of file
@@ -0,0 +1,33 @@
+import os
+import sys
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.join(REPO_ROOT, "benchmarks"))
+
+from mock_server import MockConfig, start_mock_server  # noqa: E402
+
+@pytest.fixture
+def mock_llama(tmp_path, monkeypatch):
+    """Pipeline pointed at a local mock server, with outputs in a temporary folder. Yields the server state."""
+    server, state = start_mock_server(MockConfig(latency=0.0, reply_chars=200, error_status=400, seed=1234))
+    host, port = server.server_address[:2]
+    base = f"http://{host}:{port}"
+    for name, value in {
+        "LLAMA_API_KEY": "mock",
+        "LLAMA_API_BASE_URL": f"{base}/v1/",
+        "PONDER_LLAMA_DDGS_URL": f"{base}/",
+        "PONDER_LLAMA_OUTPUT_DIR": str(tmp_path / "output"),
+        "PONDER_LLAMA_RATE_DIR": str(tmp_path / "ratelimit"),
+        "PONDER_LLAMA_RATE_LIMIT": "0",
+        "PONDER_LLAMA_CONVERGENCE_THRESHOLD": "0",
+    }.items():
+        monkeypatch.setenv(name, value)
+    for name in ("PONDER_LLAMA_MAX_CALLS", "PONDER_LLAMA_MAX_TOKENS", "PONDER_LLAMA_MAX_TURNS"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.chdir(tmp_path)
+    try:
+        yield state
+    finally:
+        server.shutdown()
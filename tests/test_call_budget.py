@@ -0,0 +1,31 @@
+import call_budget
+from call_budget import SHORT_TEXT_CHARS, is_near_duplicate, similarity
+
+WORDS = "qubit superposition entanglement calculator matrix vector gradient cache latency pipeline module function class test deploy refactor".split()
+
+def long_text(offset: int, words: int = 120) -> str:
+    return " ".join(WORDS[(i * 7 + offset) % len(WORDS)] + str(i % 13) for i in range(words))
+
+def test_short_texts_use_sequence_matcher():
+    assert is_near_duplicate("The answer is 42.", ["The answer is 42!"], threshold=0.9)
+    assert is_near_duplicate("the  ANSWER is 42", ["The answer is 42"], threshold=0.9)
+    assert not is_near_duplicate("The answer is 42.", ["Let's build a calculator first."], threshold=0.9)
+
+def test_long_texts_use_shingles(monkeypatch):
+    text = long_text(0)
+    assert len(text) > SHORT_TEXT_CHARS
+    edited = text.replace(text.split()[60], "changed", 1)
+
+    def no_sequence_matcher(*args, **kwargs):
+        raise AssertionError("SequenceMatcher used for long texts")
+
+    monkeypatch.setattr(call_budget, "SequenceMatcher", no_sequence_matcher)
+    assert is_near_duplicate(edited, [text], threshold=0.9)
+    assert not is_near_duplicate(long_text(3), [text], threshold=0.9)
+    assert 0.0 <= similarity(text, long_text(3)) < 0.5
+
+def test_window_and_disabled_threshold():
+    previous = ["The answer is 42.", "a", "b", "c"]
+    assert not is_near_duplicate("The answer is 42.", previous, threshold=0.9)
+    assert is_near_duplicate("The answer is 42.", previous, threshold=0.9, window=4)
+    assert not is_near_duplicate("The answer is 42.", ["The answer is 42."], threshold=0)
@@ -0,0 +1,54 @@
+import json
+import pytest
+from conversation import Conversation, Message, dumps_document
+
+MESSAGES = [
+    {"role": "user", "content": "Build a calculator"},
+    {"role": "assistant", "content": "Sure — here is \"code\":\n```python\nprint('ü', 1 / 2)\n```"},
+    {"role": "user", "content": ""},
+]
+
+def test_to_json_matches_json_dumps():
+    conversation = Conversation(MESSAGES)
+    for indent in (2, 4):
+        assert conversation.to_json(indent) == json.dumps(MESSAGES, indent=indent, ensure_ascii=False)
+    assert Conversation().to_json() == json.dumps([], indent=4)
+
+def test_views_match_json_dumps():
+    conversation = Conversation(MESSAGES)
+    assert conversation.prefix(2).to_json() == json.dumps(MESSAGES[:2], indent=4, ensure_ascii=False)
+    pending = conversation.window(1).with_pending("user", "next")
+    assert pending.to_json() == json.dumps(MESSAGES[-1:] + [{"role": "user", "content": "next"}], indent=4, ensure_ascii=False)
+
+def test_dumps_document_matches_json_dumps():
+    conversation = Conversation(MESSAGES)
+    document = {"prompt": "Build a calculator", "conversation_history": conversation, "turns": 3, "meta": {"a": [1, 2]}, "empty": conversation[0:0]}
+    expected = dict(document, conversation_history=MESSAGES, empty=[])
+    assert dumps_document(document) == json.dumps(expected, indent=4, ensure_ascii=False)
+    assert dumps_document({}) == json.dumps({}, indent=4)
+
+def test_cached_encoding_survives_appends():
+    conversation = Conversation(MESSAGES[:1])
+    first = conversation.to_json()
+    conversation.append("assistant", "reply")
+    assert first == json.dumps(MESSAGES[:1], indent=4, ensure_ascii=False)
+    assert conversation.to_json() == json.dumps(MESSAGES[:1] + [{"role": "assistant", "content": "reply"}], indent=4, ensure_ascii=False)
+    assert conversation[1] == Message("assistant", "reply")
+
+def test_messages_are_read_only():
+    message = Message("user", "hi")
+    params = Conversation([message]).to_message_params()
+    assert params[0] == {"role": "user", "content": "hi"}
+    assert message == {"role": "user", "content": "hi"}
+    with pytest.raises(TypeError):
+        params[0]["content"] = "changed"
+    with pytest.raises(AttributeError):
+        message.content = "changed"
+    assert message.to_json() == json.dumps({"role": "user", "content": "hi"}, indent=4)
+
+def test_coerce_copies_lists():
+    history = [{"role": "user", "content": "hi"}]
+    conversation = Conversation.coerce(history)
+    conversation.append("assistant", "hello")
+    assert history == [{"role": "user", "content": "hi"}]
+    assert Conversation.coerce(conversation) is conversation
@@ -0,0 +1,54 @@
+import os
+import json
+import importlib
+
+step3 = importlib.import_module("3")
+
+def write_prompt(prompt_id: str = "resume") -> str:
+    os.makedirs("prompts", exist_ok=True)
+    path = os.path.join("prompts", f"prompt_{prompt_id}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"id": prompt_id, "goal": "Build a calculator", "prompt": "Build a calculator"}, f)
+    return path
+
+def fail_after(state, requests: int):
+    """Make the mock server answer every chat request after the first `requests` with an error."""
+    delay = state.delay
+
+    def failing_delay():
+        state.config.error_rate = 1.0 if state.chat_requests > requests else 0.0
+        delay()
+
+    state.delay = failing_delay
+
+def test_resume_after_failed_turn(mock_llama, monkeypatch):
+    monkeypatch.setenv("PONDER_LLAMA_MAX_TURNS", "5")
+    prompt_file = write_prompt()
+    output_dir = step3.get_output_dir()
+    # Turn 1 and its next-prompt request succeed; the completion for turn 2 fails.
+    fail_after(mock_llama, 2)
+    assert step3.process_prompt_file(prompt_file) is False
+    checkpoint = step3.load_checkpoint("resume")
+    assert checkpoint is not None and not checkpoint["complete"]
+    assert (checkpoint["stage"], checkpoint["turn"]) == ("conversation", 1)
+    assert not os.path.exists(os.path.join(output_dir, "output_resume.md"))
+
+    mock_llama.delay = type(mock_llama).delay.__get__(mock_llama)
+    mock_llama.config.error_rate = 0.0
+    assert step3.process_prompt_file(prompt_file, resume=True) is True
+    assert step3.load_checkpoint("resume") is None
+    with open(os.path.join(output_dir, "conversation_history_resume.json"), encoding="utf-8") as f:
+        history = json.load(f)
+    replies = [m["content"] for m in history if m["role"] == "assistant"]
+    # Turn 1 is kept, not replayed; turn 2 is answered by the first request after the failure.
+    assert replies[0].startswith("Mock reply 1:")
+    assert replies[1].startswith("Mock reply 4:")
+    assert os.path.exists(os.path.join(output_dir, "output_resume.md"))
+    # Conversation: 3 requests before the failure (one failed), then turns 2-5 with 3 next prompts.
+    # Markdown: the summary call plus its 5-turn follow-up conversation.
+    conversation_calls = 2 + 4 + 3
+    markdown_calls = 1 + 5 + 4
+    assert len(replies) == 5 + 5
+    assert mock_llama.chat_requests == conversation_calls + 1 + markdown_calls
+    with open(os.path.join(output_dir, "budget_resume.json"), encoding="utf-8") as f:
+        assert json.load(f)["calls"] == conversation_calls + markdown_calls
@@ -0,0 +1,87 @@
+import time
+import threading
+import pytest
+from types import SimpleNamespace
+from module_common import llama_client_scope
+from singleflight import SingleFlight, request_key
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+def run_concurrently(flight: SingleFlight, fn, callers: int):
+    outcomes = [None] * callers
+
+    def call(index):
+        try:
+            outcomes[index] = flight.do("key", fn)
+        except Exception as e:
+            outcomes[index] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(callers)]
+    for thread in threads:
+        thread.start()
+    return threads, outcomes
+
+def test_concurrent_waiters_share_one_call():
+    flight = SingleFlight("test")
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return {"answer": 42}
+
+    threads, outcomes = run_concurrently(flight, fn, 5)
+    wait_for(lambda: flight.stats()["deduplicated"] == 4)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert all(result is outcomes[0][0] for result, _ in outcomes)
+    assert sorted(shared for _, shared in outcomes) == [False, True, True, True, True]
+    assert flight.stats() == {"group": "test", "calls": 1, "deduplicated": 4, "in_flight": 0}
+
+def test_error_fans_out_to_waiters():
+    flight = SingleFlight("test")
+    release = threading.Event()
+    error = ValueError("boom")
+
+    def fn():
+        release.wait(5)
+        raise error
+
+    threads, outcomes = run_concurrently(flight, fn, 3)
+    wait_for(lambda: flight.stats()["deduplicated"] == 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert all(outcome is error for outcome in outcomes)
+    # Nothing is cached: the next call runs again.
+    assert flight.do("key", lambda: "fresh") == ("fresh", False)
+
+def test_disabled(monkeypatch):
+    monkeypatch.setenv("PONDER_LLAMA_COALESCE", "0")
+    flight = SingleFlight("test")
+    assert flight.do("key", lambda: 1) == (1, False)
+    assert flight.stats()["calls"] == 0
+
+def test_request_key():
+    messages = [{"role": "user", "content": "hi"}]
+    assert request_key("model", messages) == request_key("model", [dict(messages[0])])
+    assert request_key("model", messages) != request_key("other", messages)
+    with pytest.raises(KeyError):
+        request_key([{"content": "no role"}])
+
+def test_llama_requests_are_keyed_by_endpoint_and_key():
+    messages = [{"role": "user", "content": "hi"}]
+    client = SimpleNamespace(base_url="http://a/v1/", api_key="secret")
+    scope = llama_client_scope(client)
+    assert "secret" not in scope
+    key = request_key(scope, "model", messages)
+    assert key == request_key(llama_client_scope(SimpleNamespace(base_url="http://a/v1/", api_key="secret")), "model", messages)
+    assert key != request_key(llama_client_scope(SimpleNamespace(base_url="http://a/v1/", api_key="other")), "model", messages)
+    assert key != request_key(llama_client_scope(SimpleNamespace(base_url="http://b/v1/", api_key="secret")), "model", messages)
@@ -0,0 +1,58 @@
+import os
+import json
+import time
+import work_queue
+from work_queue import CLOCK_SKEW_MARGIN, try_claim
+
+def write_lease(queue_dir, key: str, worker: str, age: float = 0.0) -> str:
+    path = os.path.join(queue_dir, f"{key}.lease")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"worker": worker, "token": f"{worker}:1"}, f)
+    if age:
+        stamp = time.time() - age
+        os.utime(path, (stamp, stamp))
+    return path
+
+def test_claim_and_release(tmp_path):
+    lease = try_claim(str(tmp_path), "p1.conversation", "a", ttl=30)
+    assert lease is not None and lease.held()
+    assert try_claim(str(tmp_path), "p1.conversation", "b", ttl=30) is None
+    lease.release()
+    assert not os.path.exists(lease.path)
+    again = try_claim(str(tmp_path), "p1.conversation", "b", ttl=30)
+    assert again is not None
+    again.release()
+
+def test_takeover_of_long_expired_lease(tmp_path):
+    write_lease(tmp_path, "p1.conversation", "dead", age=CLOCK_SKEW_MARGIN + 60)
+    lease = try_claim(str(tmp_path), "p1.conversation", "b", ttl=30)
+    assert lease is not None
+    assert work_queue._read_json(lease.path)["worker"] == "b"
+    assert not os.path.exists(os.path.join(tmp_path, "p1.conversation.steal"))
+    lease.release()
+
+def test_takeover_after_watching_ttl(tmp_path):
+    # mtime looks fresh to this clock: expiry must come from watching it stay unchanged.
+    path = write_lease(tmp_path, "p1.conversation", "dead")
+    assert try_claim(str(tmp_path), "p1.conversation", "b", ttl=0.2) is None
+    time.sleep(0.3)
+    lease = try_claim(str(tmp_path), "p1.conversation", "b", ttl=0.2)
+    assert lease is not None
+    assert work_queue._read_json(path)["worker"] == "b"
+    lease.release()
+
+def test_live_lease_is_not_taken_over(tmp_path):
+    holder = try_claim(str(tmp_path), "p1.conversation", "a", ttl=0.3)
+    deadline = time.monotonic() + 1.0
+    while time.monotonic() < deadline:
+        assert try_claim(str(tmp_path), "p1.conversation", "b", ttl=0.3) is None
+        time.sleep(0.05)
+    assert holder.held()
+    holder.release()
+
+def test_lost_lease_is_noticed(tmp_path):
+    lease = try_claim(str(tmp_path), "p1.conversation", "a", ttl=30)
+    write_lease(tmp_path, "p1.conversation", "thief")
+    assert not lease.held()
+    lease.release()
+    assert work_queue._read_json(lease.path)["worker"] == "thief"
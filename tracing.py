@@ -0,0 +1,309 @@
+"""
+tracing.py (StepForge hot-path instrumentation)
+
+Lightweight spans for the expensive parts of every step: LLaMA calls, searches,
+saves, linting and code runs. Each span records its duration plus counters such
+as payload sizes, tokens, cache hits and retries, and carries the prompt id as
+trace id so a run can be followed from 3.py into five_action.py.
+
+Tracing is off unless PONDER_LLAMA_TRACE=1. When off, span() and current_span()
+hand back one shared no-op object and @traced calls straight through, so
+instrumented code pays a single flag check. When on, spans are appended to
+output/trace.jsonl (rotated to trace.jsonl.1 past PONDER_LLAMA_TRACE_MAX_MB,
+default 50) and each process adds its own in-memory totals to
+output/metrics.prom (Prometheus textfile format), without re-reading the trace:
+every PONDER_LLAMA_METRICS_INTERVAL seconds (default 30), after each daemon job
+and queue step (flush_metrics()), and at exit. `python tracing.py` prints a per-span summary and rebuilds metrics.prom
+from the trace.
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import atexit
+import functools
+import threading
+import contextvars
+from typing import Any, Dict, List, Optional
+from module_common import FileLock, atomic_write, get_output_dir
+
+# Numeric span attributes that are counters and may be summed. Others (turn,
+# returncode, messages, ...) are labels or ordinals and are left out of totals.
+COUNTER_ATTRS = frozenset({
+    "tokens", "payload_bytes", "response_bytes", "code_bytes", "output_bytes",
+    "client_cache_hits", "client_cache_misses", "retries", "queue_wait_seconds",
+    "deduplicated", "coalesced_waiters", "failed", "interrupted",
+})
+
+_enabled: Optional[bool] = None
+_write_lock = threading.Lock()
+_trace_id: contextvars.ContextVar = contextvars.ContextVar("ponder_llama_trace_id", default=None)
+_current_span: contextvars.ContextVar = contextvars.ContextVar("ponder_llama_span", default=None)
+# Totals of this process's spans not yet merged into metrics.prom.
+_totals: Dict[str, Dict[str, float]] = {}
+_totals_lock = threading.Lock()
+
+def is_enabled() -> bool:
+    global _enabled
+    if _enabled is None:
+        _enabled = os.environ.get("PONDER_LLAMA_TRACE", "").lower() in ("1", "true", "yes", "on")
+        if _enabled:
+            atexit.register(write_prometheus)
+            try:
+                interval = float(os.environ.get("PONDER_LLAMA_METRICS_INTERVAL", "30"))
+            except ValueError:
+                interval = 30.0
+            if interval > 0:
+                # Long-lived processes (daemon, queue workers) may never exit cleanly.
+                threading.Thread(target=_flush_periodically, args=(interval,), name="metrics-flush", daemon=True).start()
+    return _enabled
+
+def _flush_periodically(interval: float):
+    while True:
+        time.sleep(interval)
+        write_prometheus()
+
+def flush_metrics():
+    """Merge this process's span totals into metrics.prom now (no-op when tracing is off)."""
+    if is_enabled():
+        write_prometheus()
+
+def set_trace_id(trace_id: Optional[str]):
+    """Correlate all following spans in this context with a prompt id."""
+    _trace_id.set(trace_id)
+
+def get_trace_path() -> str:
+    return os.path.join(get_output_dir(), "trace.jsonl")
+
+def get_metrics_path() -> str:
+    return os.path.join(get_output_dir(), "metrics.prom")
+
+class _NoopSpan:
+    """Stand-in returned while tracing is disabled. Falsy, so callers can skip work."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __bool__(self):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+    def add(self, key: str, amount: float = 1):
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+class Span:
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.name = name
+        self.attrs = attrs
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = None
+        self._token = None
+
+    def __enter__(self):
+        parent = _current_span.get()
+        self.parent_id = parent.span_id if parent else None
+        self._token = _current_span.set(self)
+        self.start = time.time()
+        self._perf = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._perf
+        _current_span.reset(self._token)
+        record = {
+            "trace_id": _trace_id.get(),
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": round(self.start, 6),
+            "duration": round(duration, 6),
+            "pid": os.getpid(),
+            "error": repr(exc) if exc is not None else None,
+            "attrs": self.attrs,
+        }
+        _write_record(record)
+        with _totals_lock:
+            _accumulate(_totals, record)
+        return False
+
+    def __bool__(self):
+        return True
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, key: str, amount: float = 1):
+        self.attrs[key] = self.attrs.get(key, 0) + amount
+
+def span(name: str, **attrs):
+    """Time a block of code: `with span("markdown_call", model=model) as sp: sp.set(tokens=n)`."""
+    if not is_enabled():
+        return _NOOP_SPAN
+    return Span(name, attrs)
+
+def traced(name: str):
+    """Decorator form of span(); the function can add counters through current_span()."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not is_enabled():
+                return fn(*args, **kwargs)
+            with Span(name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def current_span():
+    """The innermost open span, or the no-op span, for adding counters from helpers."""
+    return _current_span.get() or _NOOP_SPAN
+
+def _max_trace_bytes() -> int:
+    try:
+        return int(float(os.environ.get("PONDER_LLAMA_TRACE_MAX_MB", "50")) * 1024 * 1024)
+    except ValueError:
+        return 50 * 1024 * 1024
+
+def _write_record(record: Dict[str, Any]):
+    line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+    path = get_trace_path()
+    try:
+        with _write_lock:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            try:
+                if os.path.getsize(path) > _max_trace_bytes():
+                    os.replace(path, path + ".1")
+            except OSError:
+                pass
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line)
+    except OSError:
+        pass
+
+def read_spans(path: Optional[str] = None) -> List[Dict[str, Any]]:
+    path = path or get_trace_path()
+    spans = []
+    if not os.path.exists(path):
+        return spans
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                spans.append(json.loads(line))
+            except ValueError:
+                continue
+    return spans
+
+def aggregate(spans: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    """Per span name: count, errors, total seconds and the sum of each counter attribute."""
+    totals: Dict[str, Dict[str, float]] = {}
+    for record in spans:
+        _accumulate(totals, record)
+    return totals
+
+def _accumulate(totals: Dict[str, Dict[str, float]], record: Dict[str, Any]):
+    entry = totals.setdefault(record["name"], {"count": 0, "errors": 0, "seconds": 0.0})
+    entry["count"] += 1
+    entry["errors"] += 1 if record.get("error") else 0
+    entry["seconds"] += record.get("duration", 0.0)
+    for key, value in (record.get("attrs") or {}).items():
+        if key not in COUNTER_ATTRS:
+            continue
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, (int, float)):
+            entry[key] = entry.get(key, 0) + value
+
+_PROM_LINE = re.compile(r'^ponder_llama_span_(total|errors_total|seconds_total|attr_total)\{span="([^"]*)"(?:,attr="([^"]*)")?\} (\S+)$')
+_PROM_KEYS = {"total": "count", "errors_total": "errors", "seconds_total": "seconds"}
+
+def _read_prometheus(path: str) -> Dict[str, Dict[str, float]]:
+    """Parse a metrics file written by write_prometheus back into totals."""
+    totals: Dict[str, Dict[str, float]] = {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return totals
+    for line in lines:
+        match = _PROM_LINE.match(line)
+        if not match:
+            continue
+        metric, name, attr, value = match.groups()
+        entry = totals.setdefault(name, {"count": 0, "errors": 0, "seconds": 0.0})
+        entry[attr if metric == "attr_total" else _PROM_KEYS[metric]] = float(value)
+    return totals
+
+def write_prometheus(path: Optional[str] = None, totals: Optional[Dict[str, Dict[str, float]]] = None):
+    """Write the Prometheus text file.
+
+    Without totals (the atexit hook), this process's spans are added to the
+    counts already in the file. With totals, the file is replaced by them.
+    """
+    path = path or get_metrics_path()
+    if totals is None:
+        with _totals_lock:
+            pending = {name: dict(entry) for name, entry in _totals.items()}
+            _totals.clear()
+        if not pending:
+            return
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with FileLock(path + ".lock"):
+                totals = _read_prometheus(path)
+                for name, entry in pending.items():
+                    merged = totals.setdefault(name, {"count": 0, "errors": 0, "seconds": 0.0})
+                    for key, value in entry.items():
+                        merged[key] = merged.get(key, 0) + value
+                _write_prometheus_file(path, totals)
+        except OSError:
+            pass
+        return
+    if totals:
+        try:
+            _write_prometheus_file(path, totals)
+        except OSError:
+            pass
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else f"{value:.6f}"
+
+def _write_prometheus_file(path: str, totals: Dict[str, Dict[str, float]]):
+    lines = [
+        "# HELP ponder_llama_span_total Number of completed spans.",
+        "# TYPE ponder_llama_span_total counter",
+    ]
+    lines += [f'ponder_llama_span_total{{span="{name}"}} {_format_value(entry["count"])}' for name, entry in sorted(totals.items())]
+    lines += ["# HELP ponder_llama_span_errors_total Spans that ended with an exception.", "# TYPE ponder_llama_span_errors_total counter"]
+    lines += [f'ponder_llama_span_errors_total{{span="{name}"}} {_format_value(entry["errors"])}' for name, entry in sorted(totals.items())]
+    lines += ["# HELP ponder_llama_span_seconds_total Total time spent in spans.", "# TYPE ponder_llama_span_seconds_total counter"]
+    lines += [f'ponder_llama_span_seconds_total{{span="{name}"}} {entry["seconds"]:.6f}' for name, entry in sorted(totals.items())]
+    lines += ["# HELP ponder_llama_span_attr_total Sum of counter span attributes (bytes, tokens, cache hits, retries, waits, deduplicated calls).", "# TYPE ponder_llama_span_attr_total counter"]
+    for name, entry in sorted(totals.items()):
+        for key, value in sorted(entry.items()):
+            if key not in ("count", "errors", "seconds"):
+                lines.append(f'ponder_llama_span_attr_total{{span="{name}",attr="{key}"}} {_format_value(value)}')
+    atomic_write(path, "\n".join(lines) + "\n")
+
+def main():
+    totals = aggregate(read_spans())
+    if not totals:
+        print(f"No spans recorded in {get_trace_path()}. Run a step with PONDER_LLAMA_TRACE=1.")
+        return
+    print(f"{'span':<24}{'count':>7}{'errors':>8}{'total s':>10}{'avg ms':>10}  counters")
+    for name, entry in sorted(totals.items(), key=lambda item: -item[1]["seconds"]):
+        counters = ", ".join(f"{k}={v:g}" for k, v in sorted(entry.items()) if k not in ("count", "errors", "seconds"))
+        avg_ms = entry["seconds"] / entry["count"] * 1000
+        print(f"{name:<24}{entry['count']:>7}{entry['errors']:>8}{entry['seconds']:>10.3f}{avg_ms:>10.1f}  {counters}")
+    write_prometheus(totals=totals)
+    print(f"\nPrometheus metrics rebuilt from the trace and written to {get_metrics_path()}")
+
+if __name__ == "__main__":
+    main()
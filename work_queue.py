@@ -0,0 +1,348 @@
+"""
+work_queue.py (StepForge multi-worker queue)
+
+Lets several workers, on one machine or many sharing the same prompts/ folder,
+process prompts without stepping on each other. Work is claimed per prompt and
+step (conversation, then action) by creating a lease file with O_EXCL in
+prompts/.queue/. The holder refreshes the lease mtime while it works; a lease
+that has not been refreshed for --ttl seconds belongs to a dead worker and is
+taken over, and the conversation step then continues from its checkpoint.
+
+Lease mtimes come from whichever node or file server wrote them, so expiry does
+not compare them with the local clock: a lease expires once this worker has seen
+its mtime stay unchanged for --ttl seconds. Only leases older than --ttl plus
+CLOCK_SKEW_MARGIN by the local clock are taken over on first sight, so node
+clocks must agree to within that margin. --status ages use the local clock.
+
+    python work_queue.py --threads 4          # keep polling for new prompts
+    python work_queue.py --drain              # exit when nothing is left to claim
+    python work_queue.py --status
+
+Each worker writes output_<prompt_id>.* and Action_plan_<prompt_id>.md, so no two
+prompts share an output file. Output, budget and checkpoint files must live on the
+shared folder too (PONDER_LLAMA_OUTPUT_DIR) for takeover to resume instead of restart.
+"""
+
+import os
+import re
+import json
+import time
+import socket
+import logging
+import argparse
+import importlib
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from module_common import atomic_write, get_output_dir
+from singleflight import summary_line
+from tracing import flush_metrics
+
+QUEUE_STEPS = ("conversation", "action")
+DEFAULT_LEASE_TTL = 120.0
+DEFAULT_POLL_SECONDS = 5.0
+MAX_ATTEMPTS = 3
+CLOCK_SKEW_MARGIN = 300.0
+
+_PROMPT_FILE = re.compile(r"^prompt_(.+)\.json$")
+
+def get_queue_dir(prompts_dir: str = "prompts") -> str:
+    """Directory holding lease, done and failure markers, from env or prompts/.queue."""
+    return os.environ.get("PONDER_LLAMA_QUEUE_DIR", os.path.join(prompts_dir, ".queue"))
+
+def _age(path: str) -> Optional[float]:
+    """Seconds since path was last modified, or None if it does not exist."""
+    try:
+        return time.time() - os.path.getmtime(path)
+    except OSError:
+        return None
+
+_seen: Dict[str, Tuple[float, float]] = {}
+_seen_lock = threading.Lock()
+
+def _unchanged_for(path: str) -> Optional[float]:
+    """Seconds of local monotonic time since path's current mtime was first seen, or None if it does not exist."""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        with _seen_lock:
+            _seen.pop(path, None)
+        return None
+    now = time.monotonic()
+    with _seen_lock:
+        seen = _seen.get(path)
+        if seen is None or seen[0] != mtime:
+            _seen[path] = (mtime, now)
+            return 0.0
+        return now - seen[1]
+
+def _expired(path: str, ttl: float) -> Optional[bool]:
+    """Whether path went ttl seconds without a heartbeat, or None if it does not exist. Safe against clock skew."""
+    unchanged = _unchanged_for(path)
+    if unchanged is None:
+        return None
+    age = _age(path)
+    return unchanged > ttl or (age is not None and age > ttl + CLOCK_SKEW_MARGIN)
+
+def _read_json(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _create_exclusive(path: str, payload: Dict[str, Any]) -> bool:
+    """Create path with payload only if it does not exist yet (atomic on local and SMB/NFS shares)."""
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(payload, f)
+    return True
+
+class Lease:
+    """A claimed prompt/step. A background thread keeps it fresh until release()."""
+
+    def __init__(self, path: str, worker_id: str, token: str, ttl: float):
+        self.path = path
+        self.worker_id = worker_id
+        self.token = token
+        self.ttl = ttl
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._heartbeat, daemon=True)
+        self._thread.start()
+
+    def _still_ours(self) -> bool:
+        return _read_json(self.path).get("token") == self.token
+
+    def held(self) -> bool:
+        """True while this worker still owns the lease. Checked between turns of a running step."""
+        if not self.lost and not self._still_ours():
+            self.lost = True
+            logging.warning(f"Lease {os.path.basename(self.path)} was taken over by another worker.")
+        return not self.lost
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.ttl / 3):
+            if not self._still_ours():
+                self.lost = True
+                logging.warning(f"Lease {os.path.basename(self.path)} was taken over by another worker.")
+                return
+            try:
+                os.utime(self.path, None)
+            except OSError as e:
+                logging.warning(f"Failed to refresh lease {self.path}: {e}")
+
+    def release(self):
+        self._stop.set()
+        self._thread.join()
+        if not self.lost and self._still_ours():
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+def try_claim(queue_dir: str, key: str, worker_id: str, ttl: float) -> Optional[Lease]:
+    """Claim <key>.lease, taking it over if its holder stopped heartbeating. None if held."""
+    path = os.path.join(queue_dir, f"{key}.lease")
+    token = f"{worker_id}:{time.time():.6f}"
+    payload = {"worker": worker_id, "token": token, "claimed": time.time()}
+    if _create_exclusive(path, payload):
+        return Lease(path, worker_id, token, ttl)
+    if _expired(path, ttl) is False:
+        return None
+    # Expired (or just released). Only one worker may take it over: whoever creates the steal lock.
+    steal_path = os.path.join(queue_dir, f"{key}.steal")
+    if _expired(steal_path, ttl):
+        try:
+            os.remove(steal_path)
+        except OSError:
+            pass
+    if not _create_exclusive(steal_path, {"worker": worker_id}):
+        return None
+    try:
+        expired = _expired(path, ttl)
+        if expired is False:
+            return None
+        if expired:
+            previous = _read_json(path).get("worker", "unknown worker")
+            logging.warning(f"Lease {key} expired (no heartbeat from {previous} for over {ttl:.0f}s); taking over.")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        if _create_exclusive(path, payload):
+            return Lease(path, worker_id, token, ttl)
+        return None
+    finally:
+        try:
+            os.remove(steal_path)
+        except OSError:
+            pass
+
+class QueueWorker:
+    """Claims and runs prompt steps until stopped, or until nothing is claimable with drain=True."""
+
+    def __init__(self, worker_id: str, prompts_dir: str = "prompts", ttl: float = DEFAULT_LEASE_TTL, poll: float = DEFAULT_POLL_SECONDS):
+        self.worker_id = worker_id
+        self.prompts_dir = prompts_dir
+        self.queue_dir = get_queue_dir(prompts_dir)
+        self.ttl = ttl
+        self.poll = poll
+        os.makedirs(self.queue_dir, exist_ok=True)
+
+    def _marker(self, key: str, kind: str) -> str:
+        return os.path.join(self.queue_dir, f"{key}.{kind}")
+
+    def attempts(self, key: str) -> int:
+        return int(_read_json(self._marker(key, "failed")).get("attempts", 0))
+
+    def is_done(self, prompt_id: str, step: str) -> bool:
+        return os.path.exists(self._marker(f"{prompt_id}.{step}", "done"))
+
+    def candidates(self) -> List[Tuple[str, str, str]]:
+        """(prompt_id, prompt_file, step) for every step that is ready to run, oldest prompt first."""
+        prompt_files = []
+        for name in os.listdir(self.prompts_dir) if os.path.isdir(self.prompts_dir) else []:
+            match = _PROMPT_FILE.match(name)
+            if match:
+                path = os.path.join(self.prompts_dir, name)
+                prompt_files.append((os.path.getmtime(path), match.group(1), path))
+        ready = []
+        for _, prompt_id, path in sorted(prompt_files):
+            for step in QUEUE_STEPS:
+                if self.is_done(prompt_id, step):
+                    continue
+                if self.attempts(f"{prompt_id}.{step}") < MAX_ATTEMPTS:
+                    ready.append((prompt_id, path, step))
+                break  # later steps wait for this one
+        return ready
+
+    def claim_next(self) -> Optional[Tuple[Lease, str, str, str]]:
+        for prompt_id, path, step in self.candidates():
+            lease = try_claim(self.queue_dir, f"{prompt_id}.{step}", self.worker_id, self.ttl)
+            if lease is None:
+                continue
+            if self.is_done(prompt_id, step):
+                # Finished by another worker between the scan and the claim.
+                lease.release()
+                continue
+            return lease, prompt_id, path, step
+        return None
+
+    def run_step(self, lease: Lease, prompt_id: str, prompt_file: str, step: str) -> bool:
+        if step == "conversation":
+            step3 = importlib.import_module("3")
+            # A checkpoint here means a previous holder died mid-run; continue its work.
+            resume = step3.load_checkpoint(prompt_id) is not None
+            # Stop at the next turn if the lease is taken over, so two workers never write the same files.
+            return step3.process_prompt_file(prompt_file, resume=resume, should_continue=lease.held)
+        five_action = importlib.import_module("five_action")
+        plan = five_action.run_action_plan(prompt_file, output_dir=get_output_dir(), action_plan_name=f"Action_plan_{prompt_id}.md", allow_fallback=False, should_continue=lease.held)
+        return plan is not None
+
+    def run_once(self) -> bool:
+        """Claim and run one step. Returns False if there was nothing to claim."""
+        claimed = self.claim_next()
+        if claimed is None:
+            return False
+        lease, prompt_id, prompt_file, step = claimed
+        key = f"{prompt_id}.{step}"
+        logging.info(f"[{self.worker_id}] Running {step} for prompt {prompt_id}")
+        started = time.time()
+        try:
+            ok = self.run_step(lease, prompt_id, prompt_file, step)
+        except Exception as e:
+            logging.error(f"[{self.worker_id}] {step} for prompt {prompt_id} failed: {e}")
+            ok = False
+        try:
+            if lease.lost:
+                logging.warning(f"[{self.worker_id}] Lost the lease on {key}; leaving it to the new holder.")
+            elif ok:
+                atomic_write(self._marker(key, "done"), json.dumps({"worker": self.worker_id, "seconds": round(time.time() - started, 3), "finished": time.time()}))
+                logging.info(f"[{self.worker_id}] Finished {step} for prompt {prompt_id} in {time.time() - started:.1f}s")
+            else:
+                attempts = self.attempts(key) + 1
+                atomic_write(self._marker(key, "failed"), json.dumps({"worker": self.worker_id, "attempts": attempts}))
+                if attempts >= MAX_ATTEMPTS:
+                    logging.error(f"[{self.worker_id}] Giving up on {key} after {attempts} attempts.")
+        finally:
+            lease.release()
+            flush_metrics()
+        return True
+
+    def run(self, drain: bool = False, stop: Optional[threading.Event] = None):
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            if self.run_once():
+                continue
+            if drain:
+                return
+            stop.wait(self.poll)
+
+def status(prompts_dir: str = "prompts", ttl: float = DEFAULT_LEASE_TTL) -> List[Dict[str, Any]]:
+    """Per prompt and step: done, running (with holder), expired, failed or pending."""
+    worker = QueueWorker("status", prompts_dir, ttl)
+    rows = []
+    names = sorted(os.listdir(prompts_dir)) if os.path.isdir(prompts_dir) else []
+    for name in names:
+        match = _PROMPT_FILE.match(name)
+        if not match:
+            continue
+        prompt_id = match.group(1)
+        row = {"prompt_id": prompt_id}
+        for step in QUEUE_STEPS:
+            key = f"{prompt_id}.{step}"
+            lease_path = worker._marker(key, "lease")
+            age = _age(lease_path)
+            if worker.is_done(prompt_id, step):
+                row[step] = "done"
+            elif age is not None:
+                holder = _read_json(lease_path).get("worker", "?")
+                row[step] = f"running on {holder}" if age <= ttl else f"expired ({holder})"
+            elif worker.attempts(key) >= MAX_ATTEMPTS:
+                row[step] = "failed"
+            else:
+                row[step] = "pending"
+        rows.append(row)
+    return rows
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="StepForge queue worker: claim prompts from a shared prompts folder")
+    parser.add_argument("--prompts-dir", default="prompts")
+    parser.add_argument("--threads", type=int, default=1, help="worker threads in this process")
+    parser.add_argument("--ttl", type=float, default=DEFAULT_LEASE_TTL, help="seconds without heartbeat before a lease is taken over")
+    parser.add_argument("--poll", type=float, default=DEFAULT_POLL_SECONDS, help="seconds between scans when idle")
+    parser.add_argument("--drain", action="store_true", help="exit once nothing is left to claim")
+    parser.add_argument("--status", action="store_true", help="show queue state and exit")
+    args = parser.parse_args(argv)
+
+    if args.status:
+        for row in status(args.prompts_dir, args.ttl):
+            print(f"{row['prompt_id']:<40}" + "".join(f"{step}: {row[step]:<32}" for step in QUEUE_STEPS))
+        return
+
+    base_id = f"{socket.gethostname()}:{os.getpid()}"
+    stop = threading.Event()
+    threads = []
+    for index in range(max(1, args.threads)):
+        worker = QueueWorker(f"{base_id}:{index}", args.prompts_dir, args.ttl, args.poll)
+        thread = threading.Thread(target=worker.run, args=(args.drain, stop), name=worker.worker_id, daemon=True)
+        thread.start()
+        threads.append(thread)
+    logging.info(f"Queue worker {base_id} started with {len(threads)} thread(s) on {os.path.abspath(args.prompts_dir)}")
+    try:
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(timeout=0.5)
+    except KeyboardInterrupt:
+        logging.info("Stopping after the current steps finish...")
+        stop.set()
+        for thread in threads:
+            thread.join()
+    logging.info(summary_line())
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    main()